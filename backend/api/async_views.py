@@ -0,0 +1,160 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from functools import wraps
+from threading import Event, Semaphore
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.handlers.asgi import ASGIHandler
+from django.db import close_old_connections
+
+# Пул потоков для работы с БД из асинхронных представлений.
+# Его размер ограничивает число одновременных запросов к БД
+# и открытых соединений на процесс.
+orm_executor = ThreadPoolExecutor(max_workers=settings.ASYNC_ORM_THREADS,
+                                  thread_name_prefix='orm')
+# Потоки, читающие потоковые ответы (скачивание списка покупок).
+stream_executor = ThreadPoolExecutor(
+    max_workers=settings.ASYNC_ORM_THREADS, thread_name_prefix='orm-stream')
+# Сколько готовых фрагментов потокового ответа ждут отправки.
+STREAM_QUEUE_SIZE = 4
+# Как часто поток чтения, ожидая места, проверяет, не закрыт ли ответ.
+STREAM_POLL_INTERVAL = 1
+STREAM_END = object()
+
+
+def in_orm_thread(func):
+    """
+    Синхронная функция как корутина, выполняемая в пуле orm_executor.
+    Соединения потоков пула закрываются по CONN_MAX_AGE так же,
+    как в начале и в конце обычного запроса.
+    """
+    @wraps(func)
+    def call(*args, **kwargs):
+        close_old_connections()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            close_old_connections()
+
+    return sync_to_async(call, thread_sensitive=False, executor=orm_executor)
+
+
+class ThreadedStream:
+    """
+    Потоковое содержимое, которое читается в отдельном потоке
+    stream_executor (там же выполняются его запросы к БД),
+    а отдается асинхронным итератором: цикл событий ждет фрагмент
+    через await и тем временем обслуживает другие запросы.
+    Готовых фрагментов не больше STREAM_QUEUE_SIZE, поэтому память
+    не зависит от размера ответа. Создается в цикле событий.
+    """
+
+    def __init__(self, content):
+        self.content = content
+        self.loop = asyncio.get_running_loop()
+        self.chunks = asyncio.Queue()
+        self.done = asyncio.Event()
+        self.slots = Semaphore(STREAM_QUEUE_SIZE)
+        self.closed = Event()
+        stream_executor.submit(self.produce)
+
+    def put(self, item):
+        """Передает item в цикл событий; False, если ответ закрыт."""
+        while not self.closed.is_set():
+            if self.slots.acquire(timeout=STREAM_POLL_INTERVAL):
+                if self.closed.is_set():
+                    return False
+                self.loop.call_soon_threadsafe(self.chunks.put_nowait, item)
+                return True
+        return False
+
+    def produce(self):
+        close_old_connections()
+        try:
+            for chunk in self.content:
+                if not self.put(chunk):
+                    return
+            self.put(STREAM_END)
+        except Exception as error:
+            self.put(error)
+        finally:
+            close_old_connections()
+            self.loop.call_soon_threadsafe(self.done.set)
+
+    async def __aiter__(self):
+        while True:
+            item = await self.chunks.get()
+            self.slots.release()
+            if item is STREAM_END:
+                return
+            if isinstance(item, Exception):
+                raise item
+            yield item
+
+    async def aclose(self):
+        """Останавливает чтение и ждет, пока поток отпустит содержимое."""
+        self.closed.set()
+        self.slots.release()
+        await self.done.wait()
+
+
+class StreamingASGIHandler(ASGIHandler):
+    """
+    ASGIHandler, который отдает async_streaming_content ответа
+    (ThreadedStream) через await. Стандартный ASGIHandler Django 3.2
+    перебирает потоковый ответ синхронно в цикле событий.
+    """
+
+    async def send_response(self, response, send):
+        content = getattr(response, 'async_streaming_content', None)
+        if content is None:
+            return await super().send_response(response, send)
+        headers = [
+            (header.encode('ascii'), value.encode('latin1'))
+            for header, value in response.items()
+        ] + [
+            (b'Set-Cookie', cookie.output(header='').encode('ascii').strip())
+            for cookie in response.cookies.values()
+        ]
+        try:
+            await send({'type': 'http.response.start',
+                        'status': response.status_code,
+                        'headers': headers})
+            async for part in content:
+                for chunk, _ in self.chunk_bytes(part):
+                    await send({'type': 'http.response.body',
+                                'body': chunk, 'more_body': True})
+            await send({'type': 'http.response.body'})
+        finally:
+            await content.aclose()
+            await sync_to_async(response.close, thread_sensitive=True)()
+
+
+def async_view(view):
+    """
+    Представление DRF как асинхронное.
+    Запрос обрабатывается целиком в пуле orm_executor: права, запросы к БД
+    и отрисовка ответа. Цикл событий только отправляет готовый ответ,
+    поэтому медленный клиент не занимает поток.
+    Потоковый ответ читается по частям в потоке ThreadedStream
+    и отдается StreamingASGIHandler (foodgram/asgi.py).
+    """
+    def handle(request, *args, **kwargs):
+        response = view(request, *args, **kwargs)
+        if not response.streaming and callable(
+                getattr(response, 'render', None)):
+            response.render()
+        return response
+
+    handle = in_orm_thread(handle)
+
+    @wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        response = await handle(request, *args, **kwargs)
+        if response.streaming:
+            response.async_streaming_content = ThreadedStream(
+                response.streaming_content)
+        return response
+
+    return wrapper
@@ -0,0 +1,96 @@
+from django.conf import settings
+from django.core.cache import DEFAULT_CACHE_ALIAS, cache, caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.http import HttpResponse
+from django.utils.cache import patch_vary_headers
+from django.utils.http import urlencode
+
+from api.compression import (BROTLI_MAX_QUALITY, ENCODINGS, choose_encoding,
+                             precompress,)
+
+CACHE_STATS_KEY = 'catalog_cache:{}'
+
+
+def cache_is_shared():
+    """Общий ли кеш для всех процессов (например, Redis)."""
+    return not isinstance(caches[DEFAULT_CACHE_ALIAS],
+                          (LocMemCache, DummyCache))
+
+
+def count(event):
+    """
+    Счетчик попаданий и промахов. Общий для всех процессов только
+    при общем кеше, иначе каждый процесс считает свои.
+    """
+    key = CACHE_STATS_KEY.format(event)
+    cache.add(key, 0, timeout=None)
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.set(key, 1, timeout=None)
+
+
+def get_stats():
+    stats = {event: cache.get(CACHE_STATS_KEY.format(event), 0)
+             for event in ('hits', 'misses')}
+    total = stats['hits'] + stats['misses']
+    stats['hit_ratio'] = round(stats['hits'] / total, 4) if total else 0
+    stats['shared'] = cache_is_shared()
+    return stats
+
+
+def cache_path(request, params):
+    """
+    Путь запроса только с параметрами params, от которых зависит ответ.
+    Остальные параметры не создают новых записей в кеше.
+    """
+    query = urlencode(sorted(
+        (name, value) for name in params
+        for value in request.query_params.getlist(name)))
+    return f'{request.path}?{query}' if query else request.path
+
+
+def cached_response(view, request, version_key, version, path,
+                    *args, **kwargs):
+    """
+    Готовый JSON справочника из кеша.
+    Ключ содержит версию справочника, поэтому изменение в админке
+    или импорт сразу делают старые записи недоступными,
+    и путь path из cache_path.
+    Вместе с ответом хранятся его сжатые варианты, и клиент получает
+    подходящий по Accept-Encoding без повторного сжатия.
+    Максимальным качеством brotli (сотни миллисекунд на полный
+    справочник) сжимаются только ответы без параметров, их число
+    ограничено; ответы поиска сжимаются с качеством BROTLI_QUALITY.
+    """
+    renderer = request.accepted_renderer
+    if renderer.format != 'json':
+        return view(request, *args, **kwargs)
+    key = (f'catalog_cache:{version_key}:{version}:'
+           f'{request.accepted_media_type}:{path}')
+    variants = cache.get(key)
+    if variants is None:
+        count('misses')
+        response = view(request, *args, **kwargs)
+        if response.status_code != 200:
+            return response
+        content = renderer.render(response.data, request.accepted_media_type,
+                                  {'request': request})
+        quality = BROTLI_MAX_QUALITY if path == request.path else None
+        variants = {'identity': content,
+                    **precompress(content, quality=quality)}
+        cache.set(key, variants, timeout=settings.CATALOG_CACHE_TIMEOUT)
+        state = 'MISS'
+    else:
+        count('hits')
+        state = 'HIT'
+    encoding = choose_encoding(request, available=[
+        encoding for encoding in ENCODINGS if encoding in variants])
+    response = HttpResponse(variants[encoding or 'identity'],
+                            content_type=renderer.media_type)
+    if encoding is not None:
+        response['Content-Encoding'] = encoding
+    response['X-Cache'] = state
+    patch_vary_headers(response, ('Accept', 'Accept-Encoding'))
+    return response
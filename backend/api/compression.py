@@ -0,0 +1,116 @@
+import brotli
+from django.conf import settings
+from django.utils.cache import patch_vary_headers
+from django.utils.deprecation import MiddlewareMixin
+from django.utils.text import compress_sequence, compress_string
+
+# Порядок предпочтения при равном весе в Accept-Encoding.
+ENCODINGS = ('br', 'gzip')
+# Качество brotli для полных справочников, сжимаемых раз на версию.
+BROTLI_MAX_QUALITY = 11
+
+
+def accepted_encodings(request):
+    """Кодировки из Accept-Encoding с весом: {'br': 1.0, 'gzip': 0.5}."""
+    weights = {}
+    for part in request.META.get('HTTP_ACCEPT_ENCODING', '').split(','):
+        coding, *params = part.lower().split(';')
+        weight = 1.0
+        for param in params:
+            name, _, value = param.strip().partition('=')
+            if name == 'q':
+                try:
+                    weight = float(value)
+                except ValueError:
+                    weight = 0.0
+        if coding.strip():
+            weights[coding.strip()] = weight
+    return weights
+
+
+def choose_encoding(request, available=ENCODINGS):
+    """
+    Кодировка ответа по Accept-Encoding или None, если клиент
+    не принимает ни одну из доступных.
+    """
+    weights = accepted_encodings(request)
+    default = weights.get('*', 0.0)
+    best, best_weight = None, 0.0
+    for encoding in available:
+        weight = weights.get(encoding, default)
+        if weight > best_weight:
+            best, best_weight = encoding, weight
+    return best
+
+
+def compress(content, encoding, quality=None):
+    if encoding == 'br':
+        return brotli.compress(
+            content, quality=(settings.BROTLI_QUALITY if quality is None
+                              else quality))
+    return compress_string(content)
+
+
+def compress_sequence_br(sequence):
+    """Потоковое сжатие brotli, каждый фрагмент отдается сразу."""
+    compressor = brotli.Compressor(quality=settings.BROTLI_QUALITY)
+    for item in sequence:
+        data = compressor.process(item) + compressor.flush()
+        if data:
+            yield data
+    yield compressor.finish()
+
+
+def precompress(content, quality=None):
+    """
+    Сжатые варианты ответа для хранения в кеше:
+    {'br': ..., 'gzip': ...}, пустой словарь для маленьких ответов.
+    quality - качество brotli, по умолчанию BROTLI_QUALITY.
+    """
+    if len(content) < settings.COMPRESSION_MIN_SIZE:
+        return {}
+    variants = {encoding: compress(content, encoding, quality=quality)
+                for encoding in ENCODINGS}
+    return {encoding: data for encoding, data in variants.items()
+            if len(data) < len(content)}
+
+
+def weaken_etag(response):
+    """Сжатое тело отличается побайтно, поэтому ETag становится слабым."""
+    etag = response.get('ETag')
+    if etag and etag.startswith('"'):
+        response['ETag'] = f'W/{etag}'
+
+
+class CompressionMiddleware(MiddlewareMixin):
+    """
+    Сжатие ответов brotli или gzip по заголовку Accept-Encoding.
+    Ответы меньше COMPRESSION_MIN_SIZE байт и уже сжатые
+    (например, готовые ответы справочников из кеша) не трогаются.
+    """
+
+    def process_response(self, request, response):
+        if (not response.streaming
+                and len(response.content) < settings.COMPRESSION_MIN_SIZE):
+            return response
+        if response.has_header('Content-Encoding'):
+            return response
+        patch_vary_headers(response, ('Accept-Encoding',))
+        encoding = choose_encoding(request)
+        if encoding is None:
+            return response
+        if response.streaming:
+            response.streaming_content = (
+                compress_sequence_br(response.streaming_content)
+                if encoding == 'br'
+                else compress_sequence(response.streaming_content))
+            del response['Content-Length']
+        else:
+            compressed = compress(response.content, encoding)
+            if len(compressed) >= len(response.content):
+                return response
+            response.content = compressed
+            response['Content-Length'] = str(len(compressed))
+        weaken_etag(response)
+        response['Content-Encoding'] = encoding
+        return response
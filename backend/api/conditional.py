@@ -0,0 +1,48 @@
+from hashlib import md5
+
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.utils.http import http_date, quote_etag
+
+from api.cache import cache_path, cached_response
+from api.compression import weaken_etag
+from recipes.signals import get_catalog_version
+
+
+def make_etag(*parts):
+    """ETag по значениям, от которых зависит ответ."""
+    return quote_etag(md5(repr(parts).encode()).hexdigest())
+
+
+def not_modified(request, etag):
+    """Ответ 304, если у клиента актуальная версия (If-None-Match)."""
+    return get_conditional_response(request, etag=etag)
+
+
+def set_validators(response, etag, last_modified=None):
+    if response.status_code not in (200, 304):
+        return response
+    response['ETag'] = etag
+    if response.has_header('Content-Encoding'):
+        weaken_etag(response)
+    if last_modified is not None:
+        response['Last-Modified'] = http_date(last_modified.timestamp())
+    patch_vary_headers(response, ('Authorization',))
+    return response
+
+
+def catalog_response(view, request, version_key, *args, params=(),
+                     **kwargs):
+    """
+    Ответ справочника с ETag по версии справочника.
+    params - параметры запроса, от которых зависит ответ.
+    Повторный запрос с тем же ETag получает 304 без чтения справочника,
+    остальные получают готовый ответ из кеша.
+    """
+    version = get_catalog_version(version_key)
+    path = cache_path(request, params)
+    etag = make_etag(version, path)
+    response = not_modified(request, etag)
+    if response is None:
+        response = cached_response(view, request, version_key, version,
+                                   path, *args, **kwargs)
+    return set_validators(response, etag)
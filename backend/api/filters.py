@@ -1,21 +1,81 @@
+from django.conf import settings
+from django.contrib.postgres.search import TrigramSimilarity
+from django.db import connection
+from django.db.models import BooleanField, Case, Q, Value, When
 from django_filters.rest_framework import FilterSet, filters
+from rest_framework.filters import OrderingFilter
 
 from recipes.models import Ingredient, Recipe, Tag
 
 
+def trigram_search_enabled():
+    return settings.TRIGRAM_SEARCH and connection.vendor == 'postgresql'
+
+
+def name_search(queryset, name, value):
+    """
+    Поиск по началу названия. В режиме триграмм (PostgreSQL)
+    к совпадениям по началу добавляются похожие названия,
+    совпадения по началу идут первыми.
+    """
+    if not trigram_search_enabled():
+        return queryset.filter(name__istartswith=value)
+    return queryset.filter(
+        Q(name__istartswith=value) | Q(name__trigram_similar=value)
+    ).annotate(
+        prefix_match=Case(When(name__istartswith=value, then=Value(True)),
+                          default=Value(False),
+                          output_field=BooleanField()),
+        similarity=TrigramSimilarity('name', value),
+    ).order_by('-prefix_match', '-similarity', 'name')
+
+
+class StableOrderingFilter(OrderingFilter):
+    """
+    Сортировка ?ordering=, дополненная id: при равных значениях
+    (например, счетчиков) страницы не пересекаются.
+    """
+
+    def get_ordering(self, request, queryset, view):
+        ordering = super().get_ordering(request, queryset, view)
+        if ordering and not {'id', '-id'} & set(ordering):
+            return (*ordering, '-id')
+        return ordering
+
+
 class RecipeFilter(FilterSet):
     """Фильтр для рецептов."""
     tags = filters.ModelMultipleChoiceFilter(
         field_name='tags__slug',
         to_field_name='slug',
-        queryset=Tag.objects.all())
+        queryset=Tag.objects.all(),
+        method='any_tags_filter')
+    tags_all = filters.ModelMultipleChoiceFilter(
+        field_name='tags__slug',
+        to_field_name='slug',
+        queryset=Tag.objects.all(),
+        method='all_tags_filter')
     is_favorited = filters.BooleanFilter(method='is_favorited_filter')
     is_in_shopping_cart = filters.BooleanFilter(
         method='is_in_shopping_cart_filter')
+    name = filters.CharFilter(method=name_search)
 
     class Meta:
         model = Recipe
-        fields = ('tags', 'author', 'is_favorited', 'is_in_shopping_cart')
+        fields = ('tags', 'tags_all', 'author', 'is_favorited',
+                  'is_in_shopping_cart', 'name')
+
+    def any_tags_filter(self, queryset, name, value):
+        """Рецепты с любым из тегов, по битовой маске тегов рецепта."""
+        if not value:
+            return queryset
+        return queryset.with_tags([tag.id for tag in value])
+
+    def all_tags_filter(self, queryset, name, value):
+        """Рецепты со всеми тегами, по битовой маске тегов рецепта."""
+        if not value:
+            return queryset
+        return queryset.with_tags([tag.id for tag in value], match_all=True)
 
     def is_favorited_filter(self, queryset, name, value):
         user = self.request.user
@@ -32,7 +92,7 @@ class RecipeFilter(FilterSet):
 
 class IngredientFilter(FilterSet):
     """Поиск о частичному вхождению в начале названия ингредиента."""
-    name = filters.CharFilter(lookup_expr='istartswith')
+    name = filters.CharFilter(method=name_search)
 
     class Meta:
         model = Ingredient
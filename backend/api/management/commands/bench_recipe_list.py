@@ -0,0 +1,83 @@
+from statistics import median
+from time import perf_counter
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from rest_framework.mixins import ListModelMixin
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from api.views import RecipeViewSet
+from users.models import User
+
+
+class SerializerRecipeViewSet(RecipeViewSet):
+    """Список рецептов через RecipeGetSerializer и JSONRenderer DRF."""
+
+    def fast_list(self, request):
+        self.action = 'list'
+        return ListModelMixin.list(self, request)
+
+    def get_renderers(self):
+        return [JSONRenderer()]
+
+
+VIEWS = {
+    'projections': RecipeViewSet,
+    'serializer': SerializerRecipeViewSet,
+}
+
+
+class Command(BaseCommand):
+    help = ('Время ответа списка рецептов по текущей базе: страница '
+            'из проекций values() (orjson) и через RecipeGetSerializer '
+            '(JSONRenderer). Показывает медиану, число запросов к БД, '
+            'размер ответа и совпадение ответов.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--path', default='/api/recipes/?limit=100')
+        parser.add_argument('--repeat', type=int, default=20)
+        parser.add_argument('--user', help='username для авторизации.')
+        parser.add_argument('--host', default='localhost',
+                            help='Заголовок Host (из ALLOWED_HOSTS).')
+
+    def handle(self, *args, **options):
+        user = None
+        if options['user']:
+            user = User.objects.filter(username=options['user']).first()
+            if user is None:
+                raise CommandError(
+                    f'Пользователь {options["user"]} не найден.')
+        factory = APIRequestFactory()
+
+        def fetch(view):
+            request = factory.get(options['path'],
+                                  HTTP_HOST=options['host'])
+            if user is not None:
+                force_authenticate(request, user)
+            response = view(request)
+            response.render()
+            return response
+
+        contents = {}
+        for name, viewset in VIEWS.items():
+            view = viewset.as_view({'get': 'list'})
+            fetch(view)
+            with CaptureQueriesContext(connection) as queries:
+                response = fetch(view)
+            timings = []
+            for _ in range(options['repeat']):
+                started = perf_counter()
+                fetch(view)
+                timings.append(perf_counter() - started)
+            contents[name] = response.content
+            self.stdout.write(
+                f'{name}: {median(timings) * 1000:.1f} мс, '
+                f'запросов: {len(queries)}, '
+                f'{len(response.content)} байт, '
+                f'статус {response.status_code}')
+        if len(set(contents.values())) > 1:
+            self.stderr.write('Ответы различаются.')
+        else:
+            self.stdout.write(self.style.SUCCESS('Ответы совпадают.'))
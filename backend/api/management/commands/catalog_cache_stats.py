@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+
+from api.cache import get_stats
+
+
+class Command(BaseCommand):
+    help = ('Показывает попадания и промахи кеша справочников. '
+            'Счетчики общие только при общем кеше (CACHE_BACKEND), '
+            'для кеша в памяти процесса используйте '
+            'GET /api/catalog_cache_stats/ (только администраторы).')
+
+    def handle(self, *args, **options):
+        stats = get_stats()
+        if not stats['shared']:
+            self.stderr.write(self.style.WARNING(
+                'Кеш в памяти процесса: команда видит только свои '
+                'счетчики. Статистика сервера: '
+                'GET /api/catalog_cache_stats/.'))
+            return
+        self.stdout.write(f'Попадания: {stats["hits"]}, '
+                          f'промахи: {stats["misses"]}, '
+                          f'доля попаданий: {stats["hit_ratio"]:.1%}')
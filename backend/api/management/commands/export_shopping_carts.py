@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+
+from api.subfile import (CSV_FIELDS, CSV_HEADER, all_shopping_lists, chunked,
+                         csv_lines,)
+
+
+class Command(BaseCommand):
+    help = 'Выгружает списки покупок всех пользователей в CSV потоком.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output', default='-',
+                            help='Файл для записи, по умолчанию stdout.')
+
+    def handle(self, *args, **options):
+        chunks = chunked(csv_lines(
+            all_shopping_lists(),
+            header=('Пользователь', *CSV_HEADER),
+            fields=('user__email', *CSV_FIELDS),
+        ))
+        if options['output'] == '-':
+            for chunk in chunks:
+                self.stdout.write(chunk, ending='')
+            return
+        with open(options['output'], 'w', encoding='utf-8',
+                  newline='') as file:
+            file.writelines(chunks)
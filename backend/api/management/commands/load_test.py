@@ -0,0 +1,69 @@
+from concurrent.futures import ThreadPoolExecutor
+from statistics import quantiles
+from time import monotonic, sleep
+
+import requests
+from django.core.management.base import BaseCommand
+
+PATHS = ('/api/tags/', '/api/ingredients/', '/api/recipes/?limit=6',
+         '/api/recipes/?limit=100')
+CHUNK_SIZE = 1024
+
+
+class Command(BaseCommand):
+    help = ('Нагрузочный тест запущенного сервера: клиенты параллельно '
+            'запрашивают адреса API по кругу. С --read-delay клиенты '
+            'читают ответ медленно, как на плохом соединении. '
+            'Используется для сравнения WSGI- и ASGI-развертываний.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('base_url', help='Например, http://127.0.0.1:8000')
+        parser.add_argument('--path', action='append', dest='paths',
+                            help='Адрес для запросов, можно несколько раз.')
+        parser.add_argument('--clients', type=int, default=20)
+        parser.add_argument('--requests', type=int, default=1000)
+        parser.add_argument('--token', help='Токен для авторизации.')
+        parser.add_argument(
+            '--read-delay', type=float, default=0,
+            help=f'Пауза, секунды, после каждых {CHUNK_SIZE} байт ответа.')
+
+    def handle(self, *args, **options):
+        paths = options['paths'] or PATHS
+        headers = {'Accept-Encoding': 'identity'}
+        if options['token']:
+            headers['Authorization'] = f'Token {options["token"]}'
+        sessions = {}
+
+        def fetch(number):
+            session = sessions.setdefault(number % options['clients'],
+                                          requests.Session())
+            url = options['base_url'] + paths[number % len(paths)]
+            started = monotonic()
+            try:
+                with session.get(url, headers=headers, stream=True,
+                                 timeout=60) as response:
+                    for _ in response.iter_content(CHUNK_SIZE):
+                        if options['read_delay']:
+                            sleep(options['read_delay'])
+                    ok = response.status_code < 400
+            except requests.RequestException:
+                ok = False
+            return ok, monotonic() - started
+
+        started = monotonic()
+        with ThreadPoolExecutor(max_workers=options['clients']) as pool:
+            results = list(pool.map(fetch, range(options['requests'])))
+        elapsed = monotonic() - started
+        timings = sorted(duration for ok, duration in results if ok)
+        errors = len(results) - len(timings)
+        if len(timings) < 2:
+            self.stderr.write(f'Успешных ответов: {len(timings)}, '
+                              f'ошибок: {errors}')
+            return
+        p50, p95, p99 = (quantiles(timings, n=100)[index]
+                         for index in (49, 94, 98))
+        self.stdout.write(
+            f'Запросов: {len(results)}, ошибок: {errors}, '
+            f'{len(timings) / elapsed:.0f} запросов/с, '
+            f'p50 {p50 * 1000:.0f} мс, p95 {p95 * 1000:.0f} мс, '
+            f'p99 {p99 * 1000:.0f} мс')
@@ -1,6 +1,118 @@
-from rest_framework.pagination import PageNumberPagination
+import json
+from hashlib import md5
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import EmptyResultSet
+from django.core.paginator import Paginator
+from django.db import connections
+from django.db.models import QuerySet
+from django.utils.functional import cached_property
+from rest_framework.pagination import CursorPagination, PageNumberPagination
+from rest_framework.response import Response
 
 
 class LimitPagePagination(PageNumberPagination):
     page_size = 6
     page_size_query_param = 'limit'
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Количество объектов кешируется на PAGE_COUNT_CACHE_TIMEOUT секунд
+    по тексту запроса (то есть по набору фильтров и пользователю).
+    На PostgreSQL при оценке планировщика больше
+    PAGE_COUNT_ESTIMATE_THRESHOLD вместо COUNT(*) берется оценка.
+    """
+    count_estimated = False
+
+    @cached_property
+    def count(self):
+        if not isinstance(self.object_list, QuerySet):
+            return super().count
+        try:
+            sql, params = self.object_list.query.sql_with_params()
+        except EmptyResultSet:
+            return 0
+        key = 'page_count:' + md5(repr((sql, params)).encode()).hexdigest()
+        cached = cache.get(key)
+        if cached is None:
+            cached = self.estimate_or_count(sql, params)
+            cache.set(key, cached, timeout=settings.PAGE_COUNT_CACHE_TIMEOUT)
+        count, self.count_estimated = cached
+        return count
+
+    def estimate_or_count(self, sql, params):
+        connection = connections[self.object_list.db]
+        if connection.vendor == 'postgresql':
+            with connection.cursor() as cursor:
+                cursor.execute(f'EXPLAIN (FORMAT JSON) {sql}', params)
+                plan = cursor.fetchone()[0]
+            if isinstance(plan, str):
+                plan = json.loads(plan)
+            estimate = plan[0]['Plan']['Plan Rows']
+            if estimate > settings.PAGE_COUNT_ESTIMATE_THRESHOLD:
+                return estimate, True
+        return self.object_list.count(), False
+
+
+class EstimatedCountPagination(LimitPagePagination):
+    """
+    Постраничная пагинация с дешевым подсчетом количества.
+    Поле count_estimated показывает, что count - оценка.
+    """
+    django_paginator_class = EstimatedCountPaginator
+
+    def get_paginated_response(self, data):
+        return Response({
+            'count': self.page.paginator.count,
+            'count_estimated': self.page.paginator.count_estimated,
+            'next': self.get_next_link(),
+            'previous': self.get_previous_link(),
+            'results': data,
+        })
+
+
+class RecipeCursorPagination(CursorPagination):
+    """
+    Пагинация по курсору (pub_date, id): без COUNT(*) и OFFSET,
+    стоимость страницы не зависит от глубины прокрутки.
+    """
+    page_size = 6
+    page_size_query_param = 'limit'
+    ordering = ('-pub_date', '-id')
+
+    def get_ordering(self, request, queryset, view):
+        """
+        Если у представления нет фильтра сортировки, курсор идет
+        по сортировке самого queryset (лента: feed_pub_date, id).
+        """
+        if queryset.query.order_by and not any(
+                hasattr(backend, 'get_ordering')
+                for backend in getattr(view, 'filter_backends', ())):
+            return tuple(queryset.query.order_by)
+        return super().get_ordering(request, queryset, view)
+
+
+class RecipePagination(EstimatedCountPagination):
+    """
+    Постраничная пагинация, а при наличии параметра cursor
+    (для первой страницы - пустого) - пагинация по курсору.
+    """
+    cursor_query_param = 'cursor'
+
+    def is_cursor(self, request):
+        return self.cursor_query_param in request.query_params
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.cursor_pagination = None
+        if self.is_cursor(request):
+            self.cursor_pagination = RecipeCursorPagination()
+            return self.cursor_pagination.paginate_queryset(
+                queryset, request, view)
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        if self.cursor_pagination is not None:
+            return self.cursor_pagination.get_paginated_response(data)
+        return super().get_paginated_response(data)
@@ -0,0 +1,92 @@
+from collections import defaultdict
+
+from django.conf import settings
+
+from api.serializers import RecipeGetSerializer, get_subscriptions
+from recipes.images import image_variants
+from recipes.models import Recipe, RecipeIngredient
+
+RECIPE_FIELDS = RecipeGetSerializer.Meta.fields
+# Столбцы проекции для каждого поля ответа.
+FIELD_COLUMNS = {
+    'author': ('author_id', 'author__email', 'author__username',
+               'author__first_name', 'author__last_name'),
+    'is_favorited': ('is_favorited',),
+    'is_in_shopping_cart': ('is_in_shopping_cart',),
+    'name': ('name',),
+    'image': ('image',),
+    'image_variants': ('image', 'variants_image'),
+    'text': ('text',),
+    'cooking_time': ('cooking_time',),
+}
+# Поля сортировки нужны курсорной пагинации, в ответ они не попадают.
+ORDERING_FIELDS = ('pub_date', 'favorites_count', 'in_carts_count')
+
+
+def recipe_values(queryset, fields=RECIPE_FIELDS):
+    """
+    Проекция рецептов для recipe_data: только столбцы полей fields.
+    queryset должен быть аннотирован флагами with_user_flags.
+    """
+    columns = {'id': None}
+    for name in fields:
+        columns.update(dict.fromkeys(FIELD_COLUMNS.get(name, ())))
+    return queryset.values(*columns, *ORDERING_FIELDS)
+
+
+def recipe_tags(ids):
+    tags = defaultdict(list)
+    for recipe, *tag in (Recipe.tags.through.objects
+                         .filter(recipe__in=ids).order_by('tag_id')
+                         .values_list('recipe_id', 'tag_id', 'tag__name',
+                                      'tag__color', 'tag__slug')):
+        tags[recipe].append(dict(zip(('id', 'name', 'color', 'slug'), tag)))
+    return tags
+
+
+def recipe_ingredients(ids):
+    ingredients = defaultdict(list)
+    for recipe, *ingredient in (
+            RecipeIngredient.objects.filter(recipe__in=ids).order_by('id')
+            .values_list('recipe_id', 'ingredient_id', 'ingredient__name',
+                         'ingredient__measurement_unit', 'amount')):
+        ingredients[recipe].append(dict(zip(
+            ('id', 'name', 'measurement_unit', 'amount'), ingredient)))
+    return ingredients
+
+
+def recipe_data(rows, request, fields=RECIPE_FIELDS):
+    """
+    Рецепты rows из recipe_values в том же виде, что и
+    RecipeGetSerializer(many=True, fields=fields).data: те же ключи
+    в том же порядке, без сериализаторов. Теги и ингредиенты
+    загружаются по одному запросу, только если они есть в fields.
+    """
+    ids = [row['id'] for row in rows]
+    tags = recipe_tags(ids) if 'tags' in fields and ids else {}
+    ingredients = (recipe_ingredients(ids)
+                   if 'ingredients' in fields and ids else {})
+    subscriptions = (get_subscriptions(request)
+                     if 'author' in fields and ids else ())
+    builders = {
+        'id': lambda row: row['id'],
+        'tags': lambda row: tags.get(row['id'], []),
+        'author': lambda row: {
+            'email': row['author__email'],
+            'id': row['author_id'],
+            'username': row['author__username'],
+            'first_name': row['author__first_name'],
+            'last_name': row['author__last_name'],
+            'is_subscribed': row['author_id'] in subscriptions,
+        },
+        'ingredients': lambda row: ingredients.get(row['id'], []),
+        'is_favorited': lambda row: row['is_favorited'],
+        'is_in_shopping_cart': lambda row: row['is_in_shopping_cart'],
+        'name': lambda row: row['name'],
+        'image': lambda row: f'{settings.MEDIA_URL}{row["image"]}',
+        'image_variants': lambda row: image_variants(row['image'],
+                                                     row['variants_image']),
+        'text': lambda row: row['text'],
+        'cooking_time': lambda row: row['cooking_time'],
+    }
+    return [{name: builders[name](row) for name in fields} for row in rows]
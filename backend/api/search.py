@@ -0,0 +1,45 @@
+from bisect import bisect_left
+from threading import Lock
+
+from recipes.constants import INGREDIENTS_VERSION_KEY
+from recipes.models import Ingredient
+from recipes.signals import get_catalog_version
+
+
+class IngredientIndex:
+    """
+    Индекс ингредиентов в памяти процесса для поиска по началу названия.
+    Перестраивается при смене версии справочника.
+    Порядок выдачи совпадает с сортировкой по name в базе.
+    """
+    def __init__(self):
+        self.version = None
+        self.keys = None
+        self.items = None
+        self.lock = Lock()
+
+    def build(self, version):
+        self.items = list(
+            Ingredient.objects.order_by('name')
+            .values('id', 'name', 'measurement_unit'))
+        self.keys = sorted(
+            (item['name'].lower(), position)
+            for position, item in enumerate(self.items))
+        self.version = version
+
+    def search(self, prefix):
+        version = get_catalog_version(INGREDIENTS_VERSION_KEY)
+        with self.lock:
+            if self.keys is None or self.version != version:
+                self.build(version)
+            keys, items = self.keys, self.items
+        prefix = prefix.lower()
+        positions = []
+        for key, position in keys[bisect_left(keys, (prefix,)):]:
+            if not key.startswith(prefix):
+                break
+            positions.append(position)
+        return [items[position] for position in sorted(positions)]
+
+
+ingredient_index = IngredientIndex()
@@ -1,36 +1,144 @@
 import base64
+import binascii
+import json
+from collections import Counter
+from tempfile import SpooledTemporaryFile
 
 from django.conf import settings
-from django.core.files.base import ContentFile
+from django.core.files.base import File
+from django.db import transaction
 from djoser.serializers import UserCreateSerializer
 from rest_framework import serializers
 
+from recipes.constants import MAX_BATCH_RECIPES
+from recipes.images import image_variants, schedule_variants
 from recipes.models import (FavoriteRecipe, Ingredient, Recipe,
-                            RecipeIngredient, Tag,)
+                            RecipeIngredient, ShoppingListItem, Tag,)
 from users.models import Follower, User
 
 
 class Base64ImageField(serializers.ImageField):
+    """
+    Картинка строкой base64 (data:image/...;base64,...) или файлом
+    из multipart/form-data.
+    Base64 декодируется частями во временный файл, который переходит
+    на диск при превышении FILE_UPLOAD_MAX_MEMORY_SIZE.
+    """
+    chunk_size = 64 * 1024
+
     def to_internal_value(self, data):
         if isinstance(data, str) and data.startswith('data:image'):
-            format, imgstr = data.split(';base64,')
-            ext = format.split('/')[-1]
-            data = ContentFile(base64.b64decode(imgstr), name='temp.' + ext)
+            data = self.decode(data)
         return super().to_internal_value(data)
 
+    def decode(self, data):
+        start = data.find(';base64,')
+        if start == -1:
+            self.fail('invalid_image')
+        ext = data[:start].split('/')[-1]
+        start += len(';base64,')
+        file = SpooledTemporaryFile(
+            max_size=settings.FILE_UPLOAD_MAX_MEMORY_SIZE)
+        try:
+            for position in range(start, len(data), self.chunk_size):
+                file.write(base64.b64decode(
+                    data[position:position + self.chunk_size]))
+        except (binascii.Error, ValueError):
+            file.close()
+            self.fail('invalid_image')
+        file.seek(0)
+        return File(file, name='temp.' + ext)
+
+
+def get_subscriptions(request):
+    """
+    Множество id авторов, на которых подписан пользователь запроса.
+    Загружается одним запросом и кешируется на объекте запроса.
+    """
+    if not hasattr(request, 'subscriptions'):
+        user = request.user
+        request.subscriptions = (
+            set(Follower.objects.filter(user=user)
+                .values_list('author_id', flat=True))
+            if user.is_authenticated else set()
+        )
+    return request.subscriptions
+
+
+def get_objects_by_ids(model, ids, label):
+    """
+    Загружает объекты по списку id одним запросом IN
+    с проверкой повторов и несуществующих id.
+    """
+    duplicates = [pk for pk, count in Counter(ids).items() if count > 1]
+    if duplicates:
+        raise serializers.ValidationError(
+            f'{label} повторяются: {", ".join(map(str, duplicates))}')
+    objects = model.objects.in_bulk(ids)
+    missing = [pk for pk in ids if pk not in objects]
+    if missing:
+        raise serializers.ValidationError(
+            f'{label} не найдены: {", ".join(map(str, missing))}')
+    return [objects[pk] for pk in ids]
+
+
+def requested_fields(request, fields):
+    """
+    Поля ответа из fields, выбранные параметрами ?fields= и ?omit=
+    (имена через запятую). Порядок полей сохраняется,
+    неизвестные имена игнорируются.
+    """
+    only = request.query_params.get('fields')
+    omit = request.query_params.get('omit')
+    selected = set(only.split(',')) if only else set(fields)
+    if omit:
+        selected -= set(omit.split(','))
+    return tuple(name for name in fields if name in selected)
+
+
+class SelectableFieldsMixin:
+    """Аргумент fields: в ответе остаются только перечисленные поля."""
+
+    def __init__(self, *args, fields=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        if fields is not None:
+            for name in set(self.fields) - set(fields):
+                self.fields.pop(name)
+
+
+class IsSubscribedMixin(serializers.Serializer):
+    """Поле is_subscribed по подпискам пользователя запроса."""
+    is_subscribed = serializers.SerializerMethodField()
+
+    def get_is_subscribed(self, obj):
+        return obj.id in get_subscriptions(self.context['request'])
+
 
 class FavoriteShoppingCartSerializer(serializers.ModelSerializer):
     """Сериализатор для вывода рецептов в избранном и списке покупок."""
     image = Base64ImageField(max_length=None, use_url=True)
+    image_variants = serializers.SerializerMethodField()
 
     class Meta:
         model = Recipe
-        fields = ('id', 'name', 'image', 'cooking_time')
+        fields = ('id', 'name', 'image', 'image_variants', 'cooking_time')
+
+    def get_image_variants(self, obj):
+        return image_variants(obj.image, obj.variants_image)
+
+
+class RecipeIdsSerializer(serializers.Serializer):
+    """Список id рецептов для пакетного добавления и удаления."""
+    recipes = serializers.ListField(
+        child=serializers.IntegerField(min_value=1),
+        allow_empty=False,
+        max_length=MAX_BATCH_RECIPES,
+    )
 
 
-class UserSerializer(UserCreateSerializer):
+class UserSerializer(SelectableFieldsMixin, IsSubscribedMixin,
+                     UserCreateSerializer):
     """Сериализатор для пользователей."""
-    is_subscribed = serializers.SerializerMethodField()
 
     class Meta:
         model = User
@@ -38,12 +146,6 @@ class UserSerializer(UserCreateSerializer):
                   'last_name', 'is_subscribed', 'password')
         extra_kwargs = {'password': {'write_only': True}}
 
-    def get_is_subscribed(self, obj):
-        user = self.context['request'].user
-        if user.is_authenticated:
-            return Follower.objects.filter(user=user, author=obj).exists()
-        return False
-
 
 class TagSerializer(serializers.ModelSerializer):
     """Сериализатор для тегов."""
@@ -63,9 +165,8 @@ class IngredientInRecipeSerializer(serializers.ModelSerializer):
     """
     Сериализатор для ингредиентов в рецепте.
     """
-    id = serializers.PrimaryKeyRelatedField(
-        queryset=Ingredient.objects.all(),
-        source='ingredient')
+    id = serializers.PrimaryKeyRelatedField(read_only=True,
+                                            source='ingredient')
     name = serializers.CharField(source='ingredient.name', read_only=True)
     measurement_unit = serializers.CharField(
         source='ingredient.measurement_unit',
@@ -78,7 +179,20 @@ class IngredientInRecipeSerializer(serializers.ModelSerializer):
         read_only_fields = ('id', 'name', 'measurement_unit')
 
 
-class RecipeGetSerializer(serializers.ModelSerializer):
+class IngredientAmountSerializer(serializers.ModelSerializer):
+    """
+    Сериализатор для записи ингредиентов в рецепт.
+    Существование id проверяется одним запросом для всего списка.
+    """
+    id = serializers.IntegerField()
+
+    class Meta:
+        model = RecipeIngredient
+        fields = ('id', 'amount')
+
+
+class RecipeGetSerializer(SelectableFieldsMixin,
+                          serializers.ModelSerializer):
     """
     Сериализатор для получения информации о рецепте ("list", "retrieve").
     GET-запросы на получение списка рецептов, получение рецепта.
@@ -90,15 +204,18 @@ class RecipeGetSerializer(serializers.ModelSerializer):
                                                source='recipeingredients')
     is_favorited = serializers.SerializerMethodField()
     is_in_shopping_cart = serializers.SerializerMethodField()
+    image_variants = serializers.SerializerMethodField()
 
     class Meta:
         model = Recipe
         fields = ('id', 'tags', 'author', 'ingredients',
                   'is_favorited', 'is_in_shopping_cart',
-                  'name', 'image', 'text', 'cooking_time')
+                  'name', 'image', 'image_variants', 'text', 'cooking_time')
         read_only_fields = ('id', 'author', 'tags', 'ingredients')
 
     def get_is_favorited(self, obj):
+        if hasattr(obj, 'is_favorited'):
+            return obj.is_favorited
         user = self.context['request'].user
         if user.is_authenticated:
             return FavoriteRecipe.objects.filter(user=user,
@@ -106,6 +223,8 @@ class RecipeGetSerializer(serializers.ModelSerializer):
         return False
 
     def get_is_in_shopping_cart(self, obj):
+        if hasattr(obj, 'is_in_shopping_cart'):
+            return obj.is_in_shopping_cart
         user = self.context['request'].user
         if user.is_authenticated:
             return obj.shopping_cart.filter(user=user, recipe=obj).exists()
@@ -114,52 +233,113 @@ class RecipeGetSerializer(serializers.ModelSerializer):
     def get_image(self, obj):
         return f"{settings.MEDIA_URL}{obj.image}"
 
+    def get_image_variants(self, obj):
+        return image_variants(obj.image, obj.variants_image)
+
 
 class RecipeCreateSerializer(serializers.ModelSerializer):
     """
     Сериализатор для создания/обновления рецепта.
     """
-    ingredients = IngredientInRecipeSerializer(many=True)
-    tags = serializers.SlugRelatedField(many=True,
-                                        queryset=Tag.objects.all(),
-                                        slug_field='id')
+    ingredients = IngredientAmountSerializer(many=True)
+    tags = serializers.ListField(child=serializers.IntegerField())
     image = Base64ImageField(max_length=None, use_url=True)
 
-    def recipe_ingredients_amount(self, recipes, tags_data, ingredients_data):
+    def to_internal_value(self, data):
+        if hasattr(data, 'getlist'):
+            data = self.form_data(data)
+        return super().to_internal_value(data)
+
+    def form_data(self, data):
+        """
+        Данные из multipart/form-data: картинка приходит файлом,
+        ingredients - JSON-строкой, tags - JSON-строкой
+        или повторяющимся полем.
+        """
+        result = data.dict()
+        try:
+            if 'ingredients' in data:
+                result['ingredients'] = json.loads(data['ingredients'])
+            tags = data.getlist('tags')
+            if len(tags) == 1 and tags[0].startswith('['):
+                tags = json.loads(tags[0])
+            if tags:
+                result['tags'] = tags
+        except json.JSONDecodeError as error:
+            raise serializers.ValidationError(
+                {'non_field_errors': [f'Некорректный JSON: {error}']})
+        return result
+
+    def validate_ingredients(self, value):
+        ingredients = get_objects_by_ids(
+            Ingredient, [item['id'] for item in value], 'Ингредиенты')
+        return [{'ingredient': ingredient, 'amount': item['amount']}
+                for ingredient, item in zip(ingredients, value)]
+
+    def validate_tags(self, value):
+        return get_objects_by_ids(Tag, value, 'Теги')
+
+    def recipe_ingredients_amount(self, recipes, tags_data, ingredients_data,
+                                  existing=None):
         """
         Вспомогательная функция для записи ингредиентов
         и их количества в рецепт.
+        Сравнивает с уже записанными ингредиентами existing и пишет
+        только разницу: одна вставка, одно обновление и одно удаление.
+        Вставка и обновление идут без сигналов, поэтому при изменении
+        рецепта (existing передан, даже пустой) их разница переносится
+        в списки покупок здесь, удаление - сигналами.
         """
         recipes.tags.set(tags_data)
-        for item in ingredients_data:
-            ingredient = item.get('ingredient')
-            amount = item.get('amount')
-            ingredient_amount, _ = RecipeIngredient.objects.get_or_create(
-                ingredient=ingredient,
-                amount=amount,
-                recipe=recipes,
-            )
+        amounts = {item['ingredient'].id: item['amount']
+                   for item in ingredients_data}
+        changed, removed, changes = [], [], {}
+        for recipe_ingredient in existing or ():
+            amount = amounts.pop(recipe_ingredient.ingredient_id, None)
+            if amount is None:
+                removed.append(recipe_ingredient.id)
+            elif amount != recipe_ingredient.amount:
+                changes[recipe_ingredient.ingredient_id] = (
+                    amount - recipe_ingredient.amount)
+                recipe_ingredient.amount = amount
+                changed.append(recipe_ingredient)
+        changes.update(amounts)
+        if amounts:
+            RecipeIngredient.objects.bulk_create(
+                RecipeIngredient(recipe=recipes, ingredient_id=ingredient,
+                                 amount=amount)
+                for ingredient, amount in amounts.items())
+        if changed:
+            RecipeIngredient.objects.bulk_update(changed, ('amount',))
+        if removed:
+            RecipeIngredient.objects.filter(id__in=removed).delete()
+        if existing is not None and changes:
+            ShoppingListItem.objects.recipe_changed(recipes.id, changes)
         return recipes
 
+    @transaction.atomic
     def create(self, validated_data):
         tags = validated_data.pop('tags')
         ingredients = validated_data.pop('ingredients')
         recipe = Recipe.objects.create(**validated_data)
+        transaction.on_commit(lambda: schedule_variants(recipe.image.name))
         return self.recipe_ingredients_amount(
             recipe, tags, ingredients
         )
 
+    @transaction.atomic
     def update(self, instance, validated_data):
         tags = validated_data.pop('tags')
         ingredients = validated_data.pop('ingredients')
-        instance.ingredients.clear()
-        instance.tags.clear()
+        existing = list(instance.recipeingredients.all())
         for key, value in validated_data.items():
             setattr(instance, key, value)
         instance.save()
-        return self.recipe_ingredients_amount(
-            instance, tags, ingredients
-        )
+        if 'image' in validated_data:
+            transaction.on_commit(
+                lambda: schedule_variants(instance.image.name))
+        self.recipe_ingredients_amount(instance, tags, ingredients, existing)
+        return instance
 
     class Meta:
         model = Recipe
@@ -168,18 +348,21 @@ class RecipeCreateSerializer(serializers.ModelSerializer):
         read_only_fields = ('id', 'author', 'tags', 'ingredients')
 
     def to_representation(self, instance):
+        request = self.context.get('request')
+        instance = (Recipe.objects.with_related()
+                    .with_user_flags(request.user).get(pk=instance.pk))
         return RecipeGetSerializer(
             instance,
-            context={'request': self.context.get('request')}
+            context={'request': request}
         ).data
 
 
-class FollowerSerializer(serializers.ModelSerializer):
+class FollowerSerializer(SelectableFieldsMixin, IsSubscribedMixin,
+                         serializers.ModelSerializer):
     """"
     Сериализатор,предоставляющий информацию о подписках пользователя.
     Для методов def subscribe и def subscriptions.
     """
-    is_subscribed = serializers.SerializerMethodField()
     recipes = serializers.SerializerMethodField()
     recipes_count = serializers.SerializerMethodField()
 
@@ -190,11 +373,6 @@ class FollowerSerializer(serializers.ModelSerializer):
         read_only_fields = ('email', 'username', 'first_name', 'last_name',
                             'is_subscribed', 'recipes', 'recipes_count')
 
-    def get_is_subscribed(self, obj):
-        request = self.context.get('request')
-        return Follower.objects.filter(user=request.user,
-                                       author=obj).exists()
-
     def get_recipes(self, obj):
         limit = self.context['request'].query_params.get('recipes_limit')
         query = obj.recipes.all()
@@ -204,4 +382,4 @@ class FollowerSerializer(serializers.ModelSerializer):
         return recipes.data
 
     def get_recipes_count(self, obj):
-        return Recipe.objects.filter(author=obj).count()
+        return obj.recipes_count
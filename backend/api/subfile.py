@@ -1,10 +1,87 @@
-def file_generation(shoppinglist):
-    """Метод генерирует список для скачивания/файлик."""
-    shopping_list = list()
-    shopping_list.append('Ваш список покупок от Foodgram:\n')
+import csv
+import json
+
+from recipes.models import ShoppingListItem
+
+CHUNK_ROWS = 500
+CSV_HEADER = ('Ингредиент', 'Единицы измерения', 'Количество')
+CSV_FIELDS = ('ingredient__name', 'ingredient__measurement_unit', 'amount')
+
+
+class Echo:
+    """Буфер для csv.writer: возвращает строку вместо записи."""
+    def write(self, value):
+        return value
+
+
+def shopping_list(user):
+    """
+    Суммарные ингредиенты из списка покупок пользователя.
+    Строки читаются курсором на стороне сервера, а не целиком в память.
+    """
+    return (ShoppingListItem.objects
+            .filter(user=user)
+            .values('ingredient__name', 'ingredient__measurement_unit',
+                    'amount')
+            .order_by('ingredient__name')
+            .iterator(chunk_size=CHUNK_ROWS))
+
+
+def all_shopping_lists():
+    """Суммарные ингредиенты списков покупок всех пользователей."""
+    return (ShoppingListItem.objects
+            .values('user__email', 'ingredient__name',
+                    'ingredient__measurement_unit', 'amount')
+            .order_by('user__email', 'ingredient__name')
+            .iterator(chunk_size=CHUNK_ROWS))
+
+
+def chunked(lines):
+    """Склеивает строки в блоки, чтобы не отдавать по строке за раз."""
+    chunk = []
+    for line in lines:
+        chunk.append(line)
+        if len(chunk) >= CHUNK_ROWS:
+            yield ''.join(chunk)
+            chunk = []
+    if chunk:
+        yield ''.join(chunk)
+
+
+def txt_lines(shoppinglist):
+    yield 'Ваш список покупок от Foodgram:\n'
     for ingredient in shoppinglist:
-        shopping_list.append(
-            f'{ingredient["ingredient__name"]} - '
-            f'{ingredient["ingredient__measurement_unit"]} - '
-            f'{ingredient["amount"]}')
-    return '\n'.join(shopping_list)
+        yield (f'\n{ingredient["ingredient__name"]} - '
+               f'{ingredient["ingredient__measurement_unit"]} - '
+               f'{ingredient["amount"]}')
+
+
+def csv_lines(rows, header=CSV_HEADER, fields=CSV_FIELDS):
+    writer = csv.writer(Echo())
+    yield writer.writerow(header)
+    for row in rows:
+        yield writer.writerow([row[field] for field in fields])
+
+
+def json_lines(shoppinglist):
+    yield '['
+    for number, ingredient in enumerate(shoppinglist):
+        yield (',' if number else '') + json.dumps({
+            'name': ingredient['ingredient__name'],
+            'measurement_unit': ingredient['ingredient__measurement_unit'],
+            'amount': ingredient['amount'],
+        }, ensure_ascii=False)
+    yield ']'
+
+
+EXPORT_FORMATS = {
+    'txt': (txt_lines, 'text/plain; charset=utf-8'),
+    'csv': (csv_lines, 'text/csv; charset=utf-8'),
+    'json': (json_lines, 'application/json; charset=utf-8'),
+}
+
+
+def file_generation(shoppinglist, file_format='txt'):
+    """Метод генерирует список для скачивания/файлик по частям."""
+    lines, _ = EXPORT_FORMATS[file_format]
+    return chunked(lines(shoppinglist))
@@ -0,0 +1,462 @@
+import asyncio
+from threading import Event
+from unittest import mock
+
+import brotli
+from asgiref.sync import async_to_sync
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import F
+from django.http import HttpResponse, StreamingHttpResponse
+from django.test import SimpleTestCase, TestCase, override_settings
+from rest_framework.mixins import ListModelMixin
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIClient
+
+from api.async_views import (STREAM_QUEUE_SIZE, StreamingASGIHandler,
+                             ThreadedStream,)
+from api.compression import BROTLI_MAX_QUALITY
+from api.views import RecipeViewSet
+from recipes import images
+from recipes.constants import INGREDIENTS_VERSION_KEY
+from recipes.models import (CatalogVersion, FavoriteRecipe, Ingredient, Recipe,
+                            RecipeIngredient, ShoppingCart, ShoppingListItem,
+                            Tag, TimelineEntry,)
+from users.models import Follower, User
+
+
+def create_recipes(authors, tags, ingredients, per_author):
+    """Рецепты с тегами и ингредиентами для каждого автора."""
+    for author in authors:
+        for number in range(per_author):
+            recipe = Recipe.objects.create(
+                author=author, name=f'Рецепт {author.id}-{number}',
+                text='Описание', image='recipes/test.png',
+                variants_image='recipes/test.png', cooking_time=5)
+            recipe.tags.set(tags)
+            RecipeIngredient.objects.bulk_create(
+                RecipeIngredient(recipe=recipe, ingredient=ingredient,
+                                 amount=amount)
+                for amount, ingredient in enumerate(ingredients, 1))
+
+
+class RecipeTestCase(TestCase):
+    """Авторы с рецептами, пользователь с подпиской, избранным и корзиной."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.tags = [Tag.objects.create(name=f'Тег {number}',
+                                       color=f'#00000{number}',
+                                       slug=f'tag{number}')
+                    for number in range(3)]
+        cls.ingredients = [
+            Ingredient.objects.create(name=f'Ингредиент {number}',
+                                      measurement_unit='г')
+            for number in range(4)]
+        cls.authors = [
+            User.objects.create_user(
+                username=f'author{number}', email=f'author{number}@test.ru',
+                password='password', first_name='Имя', last_name='Фамилия')
+            for number in range(3)]
+        create_recipes(cls.authors, cls.tags[:2], cls.ingredients, 10)
+        cls.user = User.objects.create_user(
+            username='user', email='user@test.ru', password='password',
+            first_name='Имя', last_name='Фамилия')
+        Follower.objects.create(user=cls.user, author=cls.authors[0])
+        cls.recipe = Recipe.objects.first()
+        FavoriteRecipe.objects.create(user=cls.user, recipe=cls.recipe)
+        ShoppingCart.objects.create(user=cls.user, recipe=cls.recipe)
+
+    def setUp(self):
+        cache.clear()
+        self.anonymous = APIClient()
+        self.authorized = APIClient()
+        self.authorized.force_authenticate(self.user)
+
+
+class RecipeQueryCountTest(RecipeTestCase):
+    """Число запросов списка и карточки рецепта не зависит от их размера."""
+
+    def assert_queries(self, client, url, number):
+        cache.clear()
+        with self.assertNumQueries(number):
+            response = client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return response
+
+    def test_list_anonymous(self):
+        for limit in (6, 30):
+            with self.subTest(limit=limit):
+                response = self.assert_queries(
+                    self.anonymous, f'/api/recipes/?limit={limit}', 7)
+                self.assertEqual(len(response.json()['results']), limit)
+
+    def test_list_authorized(self):
+        for limit in (6, 30):
+            with self.subTest(limit=limit):
+                response = self.assert_queries(
+                    self.authorized, f'/api/recipes/?limit={limit}', 8)
+                self.assertEqual(len(response.json()['results']), limit)
+
+    def test_detail_anonymous(self):
+        response = self.assert_queries(
+            self.anonymous, f'/api/recipes/{self.recipe.id}/', 5)
+        self.assertFalse(response.json()['is_favorited'])
+
+    def test_detail_authorized(self):
+        response = self.assert_queries(
+            self.authorized, f'/api/recipes/{self.recipe.id}/', 6)
+        data = response.json()
+        self.assertTrue(data['is_favorited'])
+        self.assertTrue(data['is_in_shopping_cart'])
+        self.assertEqual(data['author']['is_subscribed'],
+                         data['author']['id'] == self.authors[0].id)
+
+
+class CatalogVersionTest(TestCase):
+    """Изменения справочника из другого процесса видны после сброса кеша."""
+
+    def test_version_from_database(self):
+        client = APIClient()
+        Ingredient.objects.create(name='Соль', measurement_unit='г')
+        self.assertEqual(len(client.get('/api/ingredients/?name=с').json()),
+                         1)
+        # Другой процесс: запись без сигналов и новая версия в базе.
+        Ingredient.objects.bulk_create(
+            [Ingredient(name='Сахар', measurement_unit='г')])
+        CatalogVersion.objects.filter(key=INGREDIENTS_VERSION_KEY).update(
+            version=F('version') + 1)
+        cache.clear()
+        self.assertEqual(
+            [item['name']
+             for item in client.get('/api/ingredients/?name=с').json()],
+            ['Сахар', 'Соль'])
+
+
+class RecipeConditionalTest(RecipeTestCase):
+    """ETag рецептов меняется при изменении их состава."""
+
+    def assert_changed(self, url, change):
+        etag = self.anonymous.get(url)['ETag']
+        self.assertEqual(
+            self.anonymous.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        change()
+        response = self.anonymous.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_recipe_ingredient_saved(self):
+        recipe_id = self.anonymous.get(
+            '/api/recipes/?limit=6').json()['results'][0]['id']
+        recipe_ingredient = RecipeIngredient.objects.filter(
+            recipe=recipe_id).first()
+
+        def change():
+            recipe_ingredient.amount += 1
+            recipe_ingredient.save()
+
+        self.assert_changed('/api/recipes/?limit=6', change)
+        self.assert_changed(f'/api/recipes/{recipe_id}/', change)
+
+    def test_image_variants_created(self):
+        url = f'/api/recipes/{self.recipe.id}/'
+        Recipe.objects.filter(image=self.recipe.image.name).update(
+            variants_image='')
+        schedule = mock.patch.object(images, 'schedule_variants')
+        schedule.start()
+        self.addCleanup(schedule.stop)
+
+        def change():
+            with mock.patch.object(images.default_storage, 'exists',
+                                   return_value=True):
+                images.run_generation(self.recipe.image.name)
+
+        self.assert_changed(url, change)
+        self.assertIn('_card.',
+                      self.anonymous.get(url).json()['image_variants']['card'])
+
+    def test_recipe_ingredient_deleted(self):
+        recipe_ingredient = RecipeIngredient.objects.filter(
+            recipe=self.recipe).first()
+        self.assert_changed(f'/api/recipes/{self.recipe.id}/',
+                            recipe_ingredient.delete)
+
+
+class CatalogCacheTest(TestCase):
+    """Кеш справочников: ключ и статистика."""
+
+    def setUp(self):
+        cache.clear()
+        # Версии справочников откатываются вместе с тестом, а кеш - нет.
+        self.addCleanup(cache.clear)
+        Ingredient.objects.create(name='Соль', measurement_unit='г')
+        self.client = APIClient()
+
+    def test_unused_params_share_entry(self):
+        self.assertEqual(
+            self.client.get('/api/ingredients/?x=1')['X-Cache'], 'MISS')
+        self.assertEqual(
+            self.client.get('/api/ingredients/?x=2')['X-Cache'], 'HIT')
+        self.assertEqual(
+            self.client.get('/api/ingredients/?name=с&x=3')['X-Cache'],
+            'MISS')
+        self.assertEqual(
+            self.client.get('/api/ingredients/?name=с')['X-Cache'], 'HIT')
+
+    def test_brotli_quality(self):
+        for number in range(50):
+            Ingredient.objects.create(name=f'Соль морская {number}',
+                                      measurement_unit='г')
+        for url, quality in (('/api/ingredients/?x=1', BROTLI_MAX_QUALITY),
+                             ('/api/ingredients/?name=с',
+                              settings.BROTLI_QUALITY)):
+            with self.subTest(url=url), mock.patch(
+                    'api.compression.brotli.compress',
+                    wraps=brotli.compress) as compress:
+                cache.clear()
+                response = self.client.get(url, HTTP_ACCEPT_ENCODING='br')
+                self.assertEqual(response['Content-Encoding'], 'br')
+                self.assertEqual(compress.call_args.kwargs['quality'],
+                                 quality)
+
+    def test_stats_admin_only(self):
+        self.client.get('/api/ingredients/')
+        self.client.get('/api/ingredients/')
+        self.assertEqual(
+            self.client.get('/api/catalog_cache_stats/').status_code, 401)
+        admin = User.objects.create_superuser(
+            username='admin', email='admin@test.ru', password='password')
+        self.client.force_authenticate(admin)
+        stats = self.client.get('/api/catalog_cache_stats/').json()
+        self.assertEqual((stats['hits'], stats['misses']), (1, 1))
+        self.assertFalse(stats['shared'])
+
+
+class FeedTest(RecipeTestCase):
+    """Лента читается из таймлайна и совпадает с рецептами подписок."""
+
+    def expected(self):
+        return list(Recipe.objects.filter(
+            author__following__user=self.user
+        ).order_by('-pub_date', '-id').values_list('id', flat=True))
+
+    def assert_feed(self):
+        expected = self.expected()
+        response = self.authorized.get('/api/recipes/feed/?limit=30')
+        self.assertEqual(
+            [recipe['id'] for recipe in response.json()['results']], expected)
+        ids, url = [], '/api/recipes/feed/?cursor=&limit=4'
+        while url:
+            data = self.authorized.get(url).json()
+            ids += [recipe['id'] for recipe in data['results']]
+            url = data['next']
+        self.assertEqual(ids, expected)
+
+    def test_timeline(self):
+        self.assertIn('recipes_timelineentry',
+                      str(Recipe.objects.feed(self.user).query))
+        self.assert_feed()
+
+    def test_pull_authors(self):
+        with override_settings(FEED_FANOUT_LIMIT=0):
+            cache.clear()
+            # Рецепты автора с большим числом подписчиков
+            # не попадают в таймлайн и читаются напрямую.
+            Follower.objects.create(user=self.user, author=self.authors[1])
+            TimelineEntry.objects.filter(
+                user=self.user, recipe__author=self.authors[1]).delete()
+            cache.clear()
+            self.assert_feed()
+
+    def test_author_leaves_pull_authors(self):
+        Follower.objects.create(user=self.user, author=self.authors[1])
+        with override_settings(FEED_FANOUT_LIMIT=0):
+            cache.clear()
+            TimelineEntry.objects.filter(
+                user=self.user, recipe__author=self.authors[1]).delete()
+            with self.captureOnCommitCallbacks(execute=True):
+                recipe = Recipe.objects.create(
+                    author=self.authors[1], name='Новый рецепт',
+                    text='Описание', image='recipes/test.png',
+                    cooking_time=5)
+            self.assertFalse(TimelineEntry.objects.filter(
+                recipe=recipe).exists())
+            self.assert_feed()
+        # Автор вышел из списка, когда истек кеш: рецепты, пропущенные
+        # fan_out, добавляются в таймлайны, а не пропадают из ленты.
+        cache.delete('feed:pull_authors')
+        self.assert_feed()
+        self.assertTrue(TimelineEntry.objects.filter(
+            user=self.user, recipe=recipe).exists())
+
+    def test_fan_out_uses_cached_pull_authors(self):
+        TimelineEntry.objects.pull_authors()
+        with override_settings(FEED_FANOUT_LIMIT=0), \
+                self.captureOnCommitCallbacks(execute=True):
+            # Пока кеш не обновился, лента не читает рецепты автора
+            # напрямую, поэтому fan_out раскладывает их по таймлайнам.
+            recipe = Recipe.objects.create(
+                author=User.objects.get(pk=self.authors[0].pk),
+                name='Новый рецепт',
+                text='Описание', image='recipes/test.png', cooking_time=5)
+        self.assertTrue(TimelineEntry.objects.filter(
+            user=self.user, recipe=recipe).exists())
+        self.assert_feed()
+
+
+class ShoppingCartBatchTest(RecipeTestCase):
+    """Пакетные и одиночные изменения сохраняют счетчики и итоги списка."""
+
+    def assert_consistent(self):
+        self.assertEqual(
+            sorted(ShoppingListItem.objects.values_list(
+                'user', 'ingredient', 'amount')),
+            sorted(ShoppingListItem.objects.expected()))
+        for recipe in Recipe.objects.all():
+            self.assertEqual(recipe.in_carts_count,
+                             recipe.shopping_cart.count())
+
+    def test_batch_and_single(self):
+        ids = list(Recipe.objects.values_list('id', flat=True)[:4])
+        response = self.authorized.post('/api/recipes/shopping_cart/',
+                                        {'recipes': ids}, format='json')
+        self.assertEqual(
+            [result['status'] for result in response.json()['results']],
+            ['exists' if pk == self.recipe.id else 'added' for pk in ids])
+        self.assert_consistent()
+        self.assertEqual(self.authorized.delete(
+            f'/api/recipes/{ids[1]}/shopping_cart/').status_code, 204)
+        self.assert_consistent()
+        response = self.authorized.delete('/api/recipes/shopping_cart/',
+                                          {'recipes': ids}, format='json')
+        self.assertEqual(
+            [result['status'] for result in response.json()['results']],
+            ['missing' if pk == ids[1] else 'removed' for pk in ids])
+        self.assert_consistent()
+        self.assertFalse(ShoppingListItem.objects.filter(user=self.user))
+
+
+def serializer_list(self, request):
+    """Список рецептов через RecipeGetSerializer, как до проекций."""
+    self.action = 'list'
+    return ListModelMixin.list(self, request)
+
+
+class RecipeListParityTest(RecipeTestCase):
+    """Список из проекций values() совпадает с ответом сериализатора."""
+
+    URLS = ('/api/recipes/', '/api/recipes/?page=2', '/api/recipes/?limit=50',
+            '/api/recipes/?tags=tag0&tags=tag2',
+            '/api/recipes/?is_favorited=1',
+            '/api/recipes/?is_in_shopping_cart=1',
+            '/api/recipes/?ordering=-favorites_count',
+            '/api/recipes/?cursor=&limit=4', '/api/recipes/?name=Рецепт',
+            '/api/recipes/?fields=id,name,author',
+            '/api/recipes/?omit=ingredients,text', '/api/recipes/?page=99')
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        Recipe.objects.filter(id=cls.recipe.id).update(
+            name='Борщ "пробный"\n',
+            text='строка разрыв \t\x01 / \\ эмодзи \U0001f372')
+        Ingredient.objects.filter(id=cls.ingredients[0].id).update(
+            name='соль <b>&')
+
+    def test_same_content(self):
+        urls = (*self.URLS, f'/api/recipes/?author={self.authors[1].id}')
+        for client, who in ((self.anonymous, 'anonymous'),
+                            (self.authorized, 'authorized')):
+            for url in urls:
+                with self.subTest(client=who, url=url):
+                    cache.clear()
+                    response = client.get(url)
+                    cache.clear()
+                    with mock.patch.object(RecipeViewSet, 'fast_list',
+                                           serializer_list), \
+                            mock.patch.object(
+                                RecipeViewSet, 'get_renderers',
+                                lambda view: [JSONRenderer()]):
+                        expected = client.get(url)
+                    self.assertEqual(response.status_code,
+                                     expected.status_code)
+                    self.assertEqual(response.content, expected.content)
+
+
+class ThreadedStreamTest(SimpleTestCase):
+    """
+    Потоковый ответ читается в отдельном потоке ограниченными порциями
+    и не останавливает цикл событий.
+    """
+
+    @staticmethod
+    def collect(content):
+        async def read():
+            return [chunk async for chunk in ThreadedStream(content)]
+
+        return async_to_sync(read)()
+
+    def test_content(self):
+        self.assertEqual(self.collect(iter([b'a', b'b'])), [b'a', b'b'])
+
+    def test_error(self):
+        def content():
+            yield b'a'
+            raise ValueError
+
+        with self.assertRaises(ValueError):
+            self.collect(content())
+
+    def test_close_stops_reading(self):
+        read = []
+
+        def content():
+            for number in range(100):
+                read.append(number)
+                yield b'a'
+
+        async def read_one():
+            stream = ThreadedStream(content())
+            async for _ in stream:
+                break
+            await stream.aclose()
+
+        async_to_sync(read_one)()
+        self.assertLessEqual(len(read), STREAM_QUEUE_SIZE + 2)
+
+    def test_other_request_served_during_slow_chunk(self):
+        release = Event()
+
+        def content():
+            yield b'a'
+            release.wait(5)
+            yield b'b'
+
+        async def serve():
+            handler = StreamingASGIHandler()
+            download = StreamingHttpResponse(content())
+            download.async_streaming_content = ThreadedStream(
+                download.streaming_content)
+            sent, other = [], []
+
+            async def send(message):
+                sent.append(message)
+
+            async def send_other(message):
+                other.append(message)
+
+            task = asyncio.ensure_future(handler.send_response(download,
+                                                               send))
+            while len(sent) < 2:
+                await asyncio.sleep(0.01)
+            await asyncio.wait_for(
+                handler.send_response(HttpResponse(b'ok'), send_other), 1)
+            self.assertFalse(task.done())
+            release.set()
+            await asyncio.wait_for(task, 5)
+            return sent, other
+
+        sent, other = async_to_sync(serve)()
+        self.assertEqual(other[-1]['body'], b'ok')
+        self.assertEqual(b''.join(message.get('body', b'')
+                                  for message in sent[1:]), b'ab')
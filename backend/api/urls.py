@@ -1,11 +1,21 @@
-from django.urls import include, path
+from django.conf import settings
+from django.urls import URLPattern, include, path
 from djoser.views import UserViewSet as DjoserUserViewSet
 from rest_framework import routers
 
-from api.views import IngredientViewSet, RecipeViewSet, TagViewSet, UserViewSet
+from api.async_views import async_view
+from api.views import (CatalogCacheStatsView, IngredientViewSet, RecipeViewSet,
+                       TagViewSet, UserViewSet,)
 
 app_name = 'api'
 
+# Маршруты, которые в ASGI-развертывании обслуживаются асинхронно.
+ASYNC_ROUTES = (
+    'tags-list', 'tags-detail',
+    'ingredients-list', 'ingredients-detail',
+    'recipes-list', 'recipes-detail', 'recipes-download-shopping-cart',
+)
+
 router_v1 = routers.DefaultRouter()
 
 router_v1.register('tags', TagViewSet, basename='tags')
@@ -19,6 +29,12 @@ urlpatterns = [
     path('users/set_password/',
          DjoserUserViewSet.as_view({'post': 'set_password'})),
     path('auth/', include('djoser.urls.authtoken')),
+    path('catalog_cache_stats/', CatalogCacheStatsView.as_view()),
 ]
 
-urlpatterns += router_v1.urls
+urlpatterns += [
+    URLPattern(url.pattern, async_view(url.callback), url.default_args,
+               url.name)
+    if settings.ASYNC_VIEWS and url.name in ASYNC_ROUTES else url
+    for url in router_v1.urls
+]
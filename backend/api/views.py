@@ -1,26 +1,73 @@
-from django.db.models import Sum
-from django.http import HttpResponse
+from django.core.paginator import InvalidPage
+from django.db import IntegrityError, transaction
+from django.db.models import Prefetch, prefetch_related_objects
+from django.http import StreamingHttpResponse
 from django.shortcuts import get_object_or_404
 from django_filters.rest_framework import DjangoFilterBackend
 from rest_framework import mixins, status
 from rest_framework.decorators import action
-from rest_framework.permissions import AllowAny, IsAuthenticated
+from rest_framework.permissions import AllowAny, IsAdminUser, IsAuthenticated
 from rest_framework.response import Response
+from rest_framework.views import APIView
 from rest_framework.viewsets import (GenericViewSet, ModelViewSet,
                                      ReadOnlyModelViewSet,)
 
-from api.filters import IngredientFilter, RecipeFilter
-from api.pagination import LimitPagePagination
+from api.cache import get_stats
+from api.conditional import (catalog_response, make_etag, not_modified,
+                             set_validators,)
+from api.filters import (IngredientFilter, RecipeFilter, StableOrderingFilter,
+                         trigram_search_enabled,)
+from api.negotiation import IgnoreFormatNegotiation
+from api.pagination import (EstimatedCountPagination, LimitPagePagination,
+                            RecipePagination,)
 from api.permissions import IsAuthorAdminAuthenticated
+from api.projections import recipe_data, recipe_values
+from api.search import ingredient_index
 from api.serializers import (FavoriteShoppingCartSerializer,
                              FollowerSerializer, IngredientSerializer,
                              RecipeCreateSerializer, RecipeGetSerializer,
-                             TagSerializer, UserSerializer,)
-from api.subfile import file_generation
-from recipes.models import (FavoriteRecipe, Ingredient, Recipe,
-                            RecipeIngredient, ShoppingCart, Tag,)
+                             RecipeIdsSerializer, TagSerializer,
+                             UserSerializer, get_subscriptions,
+                             requested_fields,)
+from api.subfile import EXPORT_FORMATS, file_generation, shopping_list
+from recipes.constants import (INGREDIENTS_VERSION_KEY, POPULAR_DEFAULT_WINDOW,
+                               POPULAR_WINDOWS, TAGS_VERSION_KEY,)
+from recipes.models import (FavoriteRecipe, Ingredient, Recipe, ShoppingCart,
+                            ShoppingListItem, Tag, change_counter,)
+from recipes.signals import get_catalog_versions
 from users.models import Follower, User
 
+RECIPE_ETAG_FIELDS = ('id', 'updated_at', 'is_favorited',
+                      'is_in_shopping_cart', 'author_id', 'author__email',
+                      'author__username', 'author__first_name',
+                      'author__last_name')
+
+
+def lock_user(user):
+    """
+    Блокирует строку пользователя до конца транзакции: изменения
+    избранного и списка покупок одного пользователя идут по очереди,
+    и счетчики и итоги списка покупок считаются по актуальным данным.
+    """
+    list(User.objects.select_for_update()
+         .filter(pk=user.pk).values_list('pk'))
+
+
+class SelectableFieldsViewMixin:
+    """
+    ?fields= и ?omit= для GET-запросов: сериализатор отдает только
+    выбранные поля, а get_queryset не подгружает данные убранных полей.
+    """
+
+    def response_fields(self, serializer_class):
+        return requested_fields(self.request, serializer_class.Meta.fields)
+
+    def get_serializer(self, *args, **kwargs):
+        if self.request.method == 'GET':
+            kwargs.setdefault(
+                'fields', self.response_fields(self.get_serializer_class()))
+        return super().get_serializer(*args, **kwargs)
+
 
 class TagViewSet(ReadOnlyModelViewSet):
     """
@@ -32,6 +79,26 @@ class TagViewSet(ReadOnlyModelViewSet):
     permission_classes = (AllowAny, )
     pagination_class = None
 
+    def list(self, request, *args, **kwargs):
+        return catalog_response(super().list, request, TAGS_VERSION_KEY,
+                                *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return catalog_response(super().retrieve, request, TAGS_VERSION_KEY,
+                                *args, **kwargs)
+
+
+class CatalogCacheStatsView(APIView):
+    """
+    Попадания и промахи кеша справочников.
+    При кеше в памяти процесса это счетчики процесса, ответившего
+    на запрос, поле shared показывает, общий ли кеш.
+    """
+    permission_classes = (IsAdminUser, )
+
+    def get(self, request):
+        return Response(get_stats())
+
 
 class IngredientViewSet(ReadOnlyModelViewSet):
     """
@@ -46,8 +113,28 @@ class IngredientViewSet(ReadOnlyModelViewSet):
     filterset_class = IngredientFilter
     pagination_class = None
 
+    def list(self, request, *args, **kwargs):
+        return catalog_response(self.search, request,
+                                INGREDIENTS_VERSION_KEY, *args,
+                                params=('name',), **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return catalog_response(super().retrieve, request,
+                                INGREDIENTS_VERSION_KEY, *args, **kwargs)
+
+    def search(self, request, *args, **kwargs):
+        """
+        Поиск по началу названия обслуживается индексом в памяти,
+        нечеткий поиск по триграммам - базой данных.
+        """
+        name = request.query_params.get('name')
+        if name and not trigram_search_enabled():
+            return Response(ingredient_index.search(name))
+        return super().list(request, *args, **kwargs)
+
 
-class RecipeViewSet(mixins.ListModelMixin,
+class RecipeViewSet(SelectableFieldsViewMixin,
+                    mixins.ListModelMixin,
                     mixins.CreateModelMixin,
                     mixins.RetrieveModelMixin,
                     mixins.DestroyModelMixin,
@@ -67,13 +154,92 @@ class RecipeViewSet(mixins.ListModelMixin,
 
     queryset = Recipe.objects.all()
     permission_classes = (IsAuthorAdminAuthenticated,)
-    pagination_class = LimitPagePagination
-    filter_backends = [DjangoFilterBackend]
+    pagination_class = RecipePagination
+    filter_backends = [DjangoFilterBackend, StableOrderingFilter]
     filterset_class = RecipeFilter
+    ordering_fields = ('pub_date', 'favorites_count', 'in_carts_count')
+    ordering = ('-pub_date', '-id')
+
+    def get_queryset(self):
+        """
+        Для чтения подгружаем связанные данные и флаги пользователя
+        фиксированным числом запросов.
+        """
+        if self.action in ('list', 'retrieve', 'popular', 'feed'):
+            fields = self.response_fields(RecipeGetSerializer)
+            recipes = (Recipe.objects.feed(self.request.user)
+                       if self.action == 'feed' else Recipe.objects)
+            return recipes.with_related(
+                author='author' in fields,
+                tags='tags' in fields,
+                ingredients='ingredients' in fields,
+            ).with_user_flags(self.request.user, fields)
+        return Recipe.objects.all()
+
+    def recipe_validators(self, rows, *extra):
+        """
+        ETag и Last-Modified по рецептам rows (значения RECIPE_ETAG_FIELDS).
+        В ETag входят флаги пользователя и версии справочников,
+        поэтому ответ 304 корректен для каждого пользователя.
+        """
+        rows = list(rows)
+        subscriptions = get_subscriptions(self.request)
+        etag = make_etag(
+            get_catalog_versions(TAGS_VERSION_KEY, INGREDIENTS_VERSION_KEY),
+            [(*row, row.author_id in subscriptions) for row in rows],
+            *extra,
+        )
+        last_modified = max((row.updated_at for row in rows), default=None)
+        return etag, last_modified
+
+    def list(self, request, *args, **kwargs):
+        """
+        Ответ 304 без сериализации, если страница не изменилась.
+        Страница собирается из проекций values() без сериализаторов.
+        """
+        if self.paginator.is_cursor(request):
+            return self.fast_list(request)
+        rows = (self.filter_queryset(
+            Recipe.objects.with_user_flags(request.user))
+            .values_list(*RECIPE_ETAG_FIELDS, named=True))
+        number = request.query_params.get(self.paginator.page_query_param, 1)
+        try:
+            page = self.paginator.django_paginator_class(
+                rows, self.paginator.get_page_size(request)).page(number)
+        except InvalidPage:
+            return self.fast_list(request)
+        etag, last_modified = self.recipe_validators(
+            page, page.paginator.count, number)
+        response = not_modified(request, etag)
+        if response is None:
+            response = self.fast_list(request)
+        return set_validators(response, etag, last_modified)
+
+    def fast_list(self, request):
+        """Список рецептов в формате RecipeGetSerializer через values()."""
+        fields = self.response_fields(RecipeGetSerializer)
+        page = self.paginate_queryset(recipe_values(self.filter_queryset(
+            Recipe.objects.with_user_flags(request.user, fields)), fields))
+        return self.get_paginated_response(
+            recipe_data(page, request, fields))
+
+    def retrieve(self, request, *args, **kwargs):
+        """Ответ 304 без сериализации, если рецепт не изменился."""
+        try:
+            etag, last_modified = self.recipe_validators(
+                Recipe.objects.with_user_flags(request.user)
+                .filter(pk=kwargs[self.lookup_field])
+                .values_list(*RECIPE_ETAG_FIELDS, named=True))
+        except (TypeError, ValueError):
+            return super().retrieve(request, *args, **kwargs)
+        response = not_modified(request, etag)
+        if response is None:
+            response = super().retrieve(request, *args, **kwargs)
+        return set_validators(response, etag, last_modified)
 
     def get_serializer_class(self):
         """Выбор сериализатора в зависимости от метода."""
-        if self.action == 'list' or self.action == 'retrieve':
+        if self.action in ('list', 'retrieve', 'feed', 'popular'):
             return RecipeGetSerializer
         return RecipeCreateSerializer
 
@@ -87,21 +253,109 @@ class RecipeViewSet(mixins.ListModelMixin,
     def method_post_delete(request, model, add_serializer, pk):
         """
         Вспомогательный метод для методов: def favorite и shopping_cart.
+        Добавление - один INSERT, повтор отсекает ограничение
+        уникальности (user, recipe), без предварительной проверки.
         """
         user = request.user
         recipe = get_object_or_404(Recipe, id=pk)
-        if request.method == 'POST':
-            if model.objects.filter(user=user,
-                                    recipe=recipe).exists():
-                return Response('Вы пытаетесь повторно добавить',
-                                status=status.HTTP_400_BAD_REQUEST)
-            model.objects.create(user=user, recipe=recipe)
-            serializer = add_serializer(recipe)
-            return Response(serializer.data, status=status.HTTP_200_OK)
-        favorite = model.objects.get(user=user, recipe=recipe)
-        favorite.delete()
+        with transaction.atomic():
+            lock_user(user)
+            if request.method == 'POST':
+                try:
+                    with transaction.atomic():
+                        model.objects.create(user=user, recipe=recipe)
+                except IntegrityError:
+                    return Response('Вы пытаетесь повторно добавить',
+                                    status=status.HTTP_400_BAD_REQUEST)
+                serializer = add_serializer(recipe)
+                return Response(serializer.data, status=status.HTTP_200_OK)
+            deleted, _ = model.objects.filter(user=user,
+                                              recipe=recipe).delete()
+        if not deleted:
+            return Response('Рецепта нет в списке',
+                            status=status.HTTP_400_BAD_REQUEST)
         return Response(status=status.HTTP_204_NO_CONTENT)
 
+    @staticmethod
+    def batch_post_delete(request, model, counter):
+        """
+        Пакетное добавление/удаление рецептов {"recipes": [id, ...]}
+        в избранное или список покупок. Для каждого id возвращается
+        результат: added, exists, removed, missing или not_found.
+        """
+        serializer = RecipeIdsSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        ids = list(dict.fromkeys(serializer.validated_data['recipes']))
+        user = request.user
+        with transaction.atomic():
+            lock_user(user)
+            found = set(Recipe.objects.filter(id__in=ids)
+                        .values_list('id', flat=True))
+            existing = set(model.objects.filter(user=user, recipe__in=ids)
+                           .values_list('recipe', flat=True))
+            if request.method == 'POST':
+                changed = [pk for pk in ids
+                           if pk in found and pk not in existing]
+                outcome, skipped = 'added', 'exists'
+                # bulk_create не отправляет сигналы: счетчики и итоги
+                # списка покупок меняются здесь одним UPDATE.
+                model.objects.bulk_create(
+                    (model(user=user, recipe_id=pk) for pk in changed),
+                    ignore_conflicts=True,
+                )
+                if changed:
+                    change_counter(Recipe.objects.filter(id__in=changed),
+                                   counter, 1)
+                    if model is ShoppingCart:
+                        ShoppingListItem.objects.add_recipes(user.id,
+                                                             changed)
+            else:
+                changed = [pk for pk in ids if pk in existing]
+                outcome, skipped = 'removed', 'missing'
+                # Счетчики и итоги списка покупок меняют сигналы удаления.
+                model.objects.filter(user=user, recipe__in=changed).delete()
+        changed = set(changed)
+        return Response({'results': [
+            {'id': pk,
+             'status': (outcome if pk in changed
+                        else skipped if pk in found else 'not_found')}
+            for pk in ids
+        ]}, status=status.HTTP_200_OK)
+
+    @action(methods=['get'],
+            detail=False,
+            permission_classes=[IsAuthenticated],
+            filter_backends=[DjangoFilterBackend],)
+    def feed(self, request):
+        """
+        Лента рецептов авторов, на которых подписан пользователь.
+        Сортировка задается таймлайном (Recipe.objects.feed), ?ordering= нет.
+        """
+        page = self.paginate_queryset(
+            self.filter_queryset(self.get_queryset()))
+        serializer = self.get_serializer(page, many=True)
+        return self.get_paginated_response(serializer.data)
+
+    @action(methods=['get'],
+            detail=False,
+            pagination_class=LimitPagePagination,)
+    def popular(self, request):
+        """
+        Рецепты, которые чаще всего добавляли в избранное и списки покупок
+        за окно ?window=1d|7d|30d. Рейтинг заранее строит команда
+        refresh_popular.
+        """
+        window = request.query_params.get('window', POPULAR_DEFAULT_WINDOW)
+        if window not in POPULAR_WINDOWS:
+            return Response(
+                {'window': f'Доступные окна: {", ".join(POPULAR_WINDOWS)}'},
+                status=status.HTTP_400_BAD_REQUEST)
+        page = self.paginate_queryset(
+            self.get_queryset().filter(popular__window=window)
+            .order_by('popular__position'))
+        serializer = self.get_serializer(page, many=True)
+        return self.get_paginated_response(serializer.data)
+
     @action(
         detail=True,
         methods=['post', 'delete'],
@@ -125,30 +379,70 @@ class RecipeViewSet(mixins.ListModelMixin,
                                        FavoriteShoppingCartSerializer,
                                        pk)
 
-    @action(methods=['get'],
+    @action(methods=['post', 'delete'],
             detail=False,
+            url_path='shopping_cart',
             permission_classes=[IsAuthenticated],)
+    def shopping_cart_batch(self, request):
+        """Пакетное добавление/удаление в список покупок."""
+        return self.batch_post_delete(request, ShoppingCart,
+                                      'in_carts_count')
+
+    @action(methods=['post', 'delete'],
+            detail=False,
+            url_path='favorite',
+            permission_classes=[IsAuthenticated],)
+    def favorite_batch(self, request):
+        """Пакетное добавление/удаление в избранное."""
+        return self.batch_post_delete(request, FavoriteRecipe,
+                                      'favorites_count')
+
+    @action(methods=['get'],
+            detail=False,
+            permission_classes=[IsAuthenticated],
+            content_negotiation_class=IgnoreFormatNegotiation,)
     def download_shopping_cart(self, request):
-        """Создаем список покупок и скачиваем файл со списком покупок."""
-        shoppinglist = (RecipeIngredient.objects
-                        .filter(recipe__shopping_cart__user=request.user)
-                        .values('ingredient__name',
-                                'ingredient__measurement_unit')
-                        .annotate(amount=Sum('amount')))
-        download_list = file_generation(shoppinglist)
-        response = HttpResponse(download_list,
-                                content_type='text/plain; charset=utf-8')
-        response['Content-Disposition'] = 'attachment; filename="file.txt"'
+        """
+        Создаем список покупок и скачиваем файл со списком покупок.
+        Формат файла задается параметром ?format=txt|csv|json,
+        файл отдается потоком.
+        """
+        file_format = request.query_params.get('format', 'txt')
+        if file_format not in EXPORT_FORMATS:
+            return Response(
+                {'format': f'Доступные форматы: {", ".join(EXPORT_FORMATS)}'},
+                status=status.HTTP_400_BAD_REQUEST)
+        _, content_type = EXPORT_FORMATS[file_format]
+        response = StreamingHttpResponse(
+            file_generation(shopping_list(request.user), file_format),
+            content_type=content_type)
+        response['Content-Disposition'] = (
+            f'attachment; filename="shopping_list.{file_format}"')
         return response
 
 
-class UserViewSet(ModelViewSet):
+class UserViewSet(SelectableFieldsViewMixin, ModelViewSet):
     queryset = User.objects.all()
     serializer_class = UserSerializer
     permission_classes = (AllowAny,)
-    pagination_class = LimitPagePagination
+    pagination_class = EstimatedCountPagination
+    filter_backends = (StableOrderingFilter,)
+    ordering_fields = ('username', 'recipes_count', 'followers_count')
     lookup_field = 'id'
 
+    def prefetch_author_recipes(self, authors):
+        """
+        Подгружает рецепты авторов одним запросом,
+        с учетом ограничения recipes_limit.
+        """
+        limit = self.request.query_params.get('recipes_limit')
+        recipes = Recipe.objects.filter(author__in=authors)
+        if limit:
+            recipes = recipes.latest_per_author(int(limit))
+        prefetch_related_objects(authors,
+                                 Prefetch('recipes', queryset=recipes))
+        return authors
+
     @action(methods=('get',),
             detail=False,
             permission_classes=[IsAuthenticated],)
@@ -169,6 +463,7 @@ class UserViewSet(ModelViewSet):
                 return Response({'message': 'Вы хотите подписаться на себя'},
                                 status=status.HTTP_400_BAD_REQUEST)
             Follower.objects.create(user=user, author=author,)
+            self.prefetch_author_recipes([author])
             serializer = FollowerSerializer(author,
                                             context={'request': request},)
             return Response(serializer.data, status=status.HTTP_201_CREATED)
@@ -186,12 +481,14 @@ class UserViewSet(ModelViewSet):
     def subscriptions(self, request, *args, **kwargs):
         """Получение списка всех подписок на пользователей."""
         user = request.user
-        following = User.objects.filter(following__user=user)
+        following = self.filter_queryset(
+            User.objects.filter(following__user=user)
+            .order_by(*User._meta.ordering))
         pages = self.paginate_queryset(following)
+        authors = list(following) if pages is None else pages
+        if 'recipes' in self.response_fields(FollowerSerializer):
+            self.prefetch_author_recipes(authors)
+        serializer = self.get_serializer(authors, many=True)
         if pages is not None:
-            serializer = FollowerSerializer(
-                pages, many=True, context={'request': request}
-            )
             return self.get_paginated_response(serializer.data)
-        serializer = self.get_serializer(pages, many=True)
         return Response(serializer.data)
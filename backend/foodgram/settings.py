@@ -34,6 +34,7 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
     'rest_framework',
     'rest_framework.authtoken',
     'django_filters',
@@ -46,6 +47,7 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    'api.compression.CompressionMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -92,6 +94,48 @@ DATABASES = {
     }
 }
 
+# Кеш: по умолчанию в памяти процесса. Для общего кеша между процессами,
+# например Redis: CACHE_BACKEND=django_redis.cache.RedisCache,
+# CACHE_LOCATION=redis://redis:6379/1 (нужен пакет django-redis).
+CACHES = {
+    'default': {
+        'BACKEND': os.getenv('CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.getenv('CACHE_LOCATION', ''),
+    }
+}
+
+# Время хранения готовых ответов справочников (теги, ингредиенты), секунды.
+CATALOG_CACHE_TIMEOUT = int(os.getenv('CATALOG_CACHE_TIMEOUT', default=24 * 60 * 60))
+
+# Версии справочников хранятся в базе. Сколько секунд процесс может
+# использовать прочитанную версию: за это время изменения, сделанные
+# другими процессами (админка, load_ingredients), доходят до всех.
+CATALOG_VERSION_TIMEOUT = int(os.getenv('CATALOG_VERSION_TIMEOUT', default=5))
+
+# Сжатие ответов (brotli, gzip): ответы меньше порога, байты, не сжимаются.
+# Качество brotli для сжатия на лету, 0-11; готовые ответы справочников
+# в кеше сжимаются с максимальным качеством.
+COMPRESSION_MIN_SIZE = int(os.getenv('COMPRESSION_MIN_SIZE', default=1024))
+BROTLI_QUALITY = int(os.getenv('BROTLI_QUALITY', default=4))
+
+# Кеширование количества объектов в постраничных ответах, секунды,
+# и порог, выше которого на PostgreSQL используется оценка планировщика.
+PAGE_COUNT_CACHE_TIMEOUT = int(os.getenv('PAGE_COUNT_CACHE_TIMEOUT', default=30))
+PAGE_COUNT_ESTIMATE_THRESHOLD = int(os.getenv('PAGE_COUNT_ESTIMATE_THRESHOLD', default=10000))
+
+# Асинхронные представления справочников, рецептов и списка покупок.
+# Включаются точкой входа foodgram/asgi.py; запросы к БД из них идут
+# в пуле из ASYNC_ORM_THREADS потоков на процесс.
+ASYNC_VIEWS = os.getenv('ASYNC_VIEWS', default='False') == 'True'
+ASYNC_ORM_THREADS = int(os.getenv('ASYNC_ORM_THREADS', default=8))
+
+# Лента подписок: авторы с большим числом подписчиков читаются напрямую,
+# остальные раскладываются по таймлайнам подписчиков при публикации.
+FEED_FANOUT_LIMIT = int(os.getenv('FEED_FANOUT_LIMIT', default=1000))
+FEED_PULL_AUTHORS_TIMEOUT = 10 * 60
+FEED_BACKFILL_SIZE = 100
+FEED_BATCH_SIZE = 1000
+
 # Password validation
 # https://docs.djangoproject.com/en/3.2/ref/settings/#auth-password-validators
 
@@ -134,6 +178,9 @@ STATIC_ROOT = os.path.join(BASE_DIR, 'collected_static')
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
+# Потоки для фонового создания уменьшенных копий картинок рецептов.
+IMAGE_VARIANT_WORKERS = int(os.getenv('IMAGE_VARIANT_WORKERS', default=2))
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/3.2/ref/settings/#default-auto-field
 
@@ -149,6 +196,11 @@ REST_FRAMEWORK = {
         'rest_framework.authentication.TokenAuthentication',
     ],
 
+    'DEFAULT_RENDERER_CLASSES': [
+        'api.renderers.ORJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
+
     'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
     'PAGE_SIZE': 6,
 
@@ -172,3 +224,6 @@ DJOSER = {
 AUTH_USER_MODEL = 'users.User'
 
 EMPLY_VALUE_DISPLAY = '-пусто-'
+
+# Нечеткий поиск по названиям через pg_trgm (только PostgreSQL).
+TRIGRAM_SEARCH = os.getenv('TRIGRAM_SEARCH', default='False') == 'True'
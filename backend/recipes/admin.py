@@ -3,7 +3,7 @@ from import_export import resources
 from import_export.admin import ImportExportModelAdmin
 
 from .models import (FavoriteRecipe, Ingredient, Recipe, RecipeIngredient,
-                     ShoppingCart, Tag,)
+                     ShoppingCart, ShoppingListItem, Tag,)
 
 
 @admin.register(Tag)
@@ -41,9 +41,10 @@ class RecipeAdmin(admin.ModelAdmin):
     list_filter = ('author', 'name', 'tags',)
     readonly_fields = ('author', 'amount_favorites')
 
-    @admin.display(description='Количество рецептов в избранном')
+    @admin.display(description='Количество рецептов в избранном',
+                   ordering='favorites_count')
     def amount_favorites(self, obj):
-        return obj.favorite.count()
+        return obj.favorites_count
 
 
 @admin.register(RecipeIngredient)
@@ -61,3 +62,9 @@ class FavoriteRecipeAdmin(admin.ModelAdmin):
 class ShoppingCartAdmin(admin.ModelAdmin):
     list_display = ('user', 'recipe',)
     search_fields = ('user',)
+
+
+@admin.register(ShoppingListItem)
+class ShoppingListItemAdmin(admin.ModelAdmin):
+    list_display = ('user', 'ingredient', 'amount',)
+    search_fields = ('user__username',)
@@ -3,3 +3,17 @@ MAX_LENGTH_CHARFIELD = 200
 MAX_LENGTH_TAG_COLOR = 7
 REDEX_TAG_SLUG = r'^[-a-zA-Z0-9_]+$'
 MIN_VALIDATOR_COOK_TIME_INGRED_AMOUNT = 1
+# Теги с id до TAG_MASK_BITS попадают в битовую маску Recipe.tags_mask
+TAG_MASK_BITS = 63
+
+# recipes/signals.py
+INGREDIENTS_VERSION_KEY = 'catalog_version:ingredients'
+TAGS_VERSION_KEY = 'catalog_version:tags'
+
+# recipes/models.py, популярные рецепты: окно ?window= -> дней
+POPULAR_WINDOWS = {'1d': 1, '7d': 7, '30d': 30}
+POPULAR_DEFAULT_WINDOW = '7d'
+POPULAR_SIZE = 100
+
+# api/serializers.py: рецептов в одном пакетном запросе
+MAX_BATCH_RECIPES = 100
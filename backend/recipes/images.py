@@ -0,0 +1,99 @@
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from threading import Lock
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import close_old_connections
+from django.utils import timezone
+from PIL import Image, ImageOps, features
+
+from recipes.models import Recipe
+
+logger = logging.getLogger(__name__)
+
+IMAGE_VARIANTS = {
+    'thumbnail': (160, 160),
+    'card': (480, 480),
+    'detail': (1280, 1280),
+}
+IMAGE_FORMAT, IMAGE_EXTENSION = (
+    ('WEBP', 'webp') if features.check('webp') else ('JPEG', 'jpg'))
+
+executor = ThreadPoolExecutor(max_workers=settings.IMAGE_VARIANT_WORKERS,
+                              thread_name_prefix='image-variants')
+pending = set()
+pending_lock = Lock()
+
+
+def variant_name(name, variant):
+    """Имя файла уменьшенной копии: recipes/<имя>_<вариант>.<формат>."""
+    return f'{os.path.splitext(name)[0]}_{variant}.{IMAGE_EXTENSION}'
+
+
+def generate_variants(name):
+    """Создает уменьшенные копии картинки для всех вариантов."""
+    with default_storage.open(name) as file:
+        image = ImageOps.exif_transpose(Image.open(file))
+        image = image.convert('RGB')
+    for variant, size in IMAGE_VARIANTS.items():
+        resized = image.copy()
+        resized.thumbnail(size)
+        buffer = BytesIO()
+        resized.save(buffer, IMAGE_FORMAT, quality=82)
+        target = variant_name(name, variant)
+        default_storage.delete(target)
+        default_storage.save(target, ContentFile(buffer.getvalue()))
+
+
+def run_generation(name):
+    """
+    Создает недостающие копии и отмечает их готовность у рецептов
+    с этой картинкой (Recipe.variants_image). Ссылки в ответе меняются,
+    поэтому меняется и updated_at, а с ним ETag рецептов.
+    После ошибки имя остается в pending, чтобы битая картинка
+    не ставилась в очередь на каждом запросе.
+    """
+    try:
+        if not all(default_storage.exists(variant_name(name, variant))
+                   for variant in IMAGE_VARIANTS):
+            generate_variants(name)
+        Recipe.objects.filter(image=name).exclude(
+            variants_image=name
+        ).update(variants_image=name, updated_at=timezone.now())
+    except Exception:
+        logger.exception('Не удалось создать копии картинки %s', name)
+        return
+    finally:
+        close_old_connections()
+    with pending_lock:
+        pending.discard(name)
+
+
+def schedule_variants(name):
+    """Ставит создание копий в пул потоков, если оно еще не запланировано."""
+    with pending_lock:
+        if not name or name in pending:
+            return
+        pending.add(name)
+    executor.submit(run_generation, name)
+
+
+def image_variants(image, variants_image=''):
+    """
+    Ссылки на уменьшенные копии картинки (FieldFile или имя файла).
+    variants_image - картинка, для которой копии уже созданы
+    (Recipe.variants_image), поэтому хранилище при ответе не читается.
+    Пока копий нет, отдается исходная картинка, а копии создаются в фоне.
+    """
+    if not image:
+        return {}
+    name = str(image)
+    if name != variants_image:
+        schedule_variants(name)
+        return dict.fromkeys(IMAGE_VARIANTS, f'{settings.MEDIA_URL}{name}')
+    return {variant: f'{settings.MEDIA_URL}{variant_name(name, variant)}'
+            for variant in IMAGE_VARIANTS}
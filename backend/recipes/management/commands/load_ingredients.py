@@ -0,0 +1,146 @@
+import csv
+import io
+import json
+import re
+from itertools import islice
+from time import monotonic
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+
+from recipes.constants import INGREDIENTS_VERSION_KEY
+from recipes.models import Ingredient
+from recipes.signals import bump_catalog_version
+
+BATCH_SIZE = 5000
+READ_SIZE = 64 * 1024
+FIELDS = ('name', 'measurement_unit')
+SEPARATORS = re.compile(r'[\s,]*')
+
+
+def csv_rows(file):
+    """Строки CSV без заголовка: (название, единица измерения)."""
+    for row in csv.reader(file):
+        if row and tuple(row[:2]) != FIELDS:
+            yield row[0], row[1]
+
+
+def json_rows(file):
+    """
+    Объекты JSON-массива [{"name": ..., "measurement_unit": ...}, ...],
+    разбираемые по мере чтения файла, без загрузки его целиком.
+    """
+    decoder = json.JSONDecoder()
+    buffer, position = file.read(READ_SIZE).lstrip(), 1
+    if not buffer.startswith('['):
+        raise CommandError('Ожидается JSON-массив объектов.')
+    while True:
+        position = SEPARATORS.match(buffer, position).end()
+        if buffer.startswith(']', position):
+            return
+        try:
+            item, position = decoder.raw_decode(buffer, position)
+        except json.JSONDecodeError:
+            chunk = file.read(READ_SIZE)
+            if not chunk:
+                raise CommandError('JSON-файл оборван или поврежден.')
+            buffer, position = buffer[position:] + chunk, 0
+            continue
+        yield item['name'], item['measurement_unit']
+
+
+READERS = {'csv': csv_rows, 'json': json_rows}
+
+
+def batches(rows, size):
+    """Уникальные в пределах пакета строки, пакетами по size."""
+    rows = iter(rows)
+    while batch := dict.fromkeys(
+            (name.strip(), unit.strip()) for name, unit in islice(rows, size)):
+        yield list(batch)
+
+
+def copy_batches(cursor, batches):
+    """PostgreSQL: пакеты через COPY во временную таблицу и один INSERT."""
+    table = Ingredient._meta.db_table
+    cursor.execute(
+        'CREATE TEMPORARY TABLE ingredient_load '
+        '(name varchar(200), measurement_unit varchar(200)) ON COMMIT DROP')
+    for batch in batches:
+        data = io.StringIO()
+        csv.writer(data).writerows(batch)
+        data.seek(0)
+        cursor.copy_expert(
+            'COPY ingredient_load (name, measurement_unit) '
+            'FROM STDIN WITH (FORMAT csv)', data)
+        yield len(batch)
+    cursor.execute(
+        f'INSERT INTO {table} (name, measurement_unit) '
+        f'SELECT DISTINCT load.name, load.measurement_unit '
+        f'FROM ingredient_load load WHERE NOT EXISTS ('
+        f'SELECT 1 FROM {table} ingredient '
+        f'WHERE ingredient.name = load.name '
+        f'AND ingredient.measurement_unit = load.measurement_unit)')
+    yield cursor.rowcount
+
+
+def insert_batches(batches):
+    """Остальные БД: bulk_create строк, которых еще нет в справочнике."""
+    for batch in batches:
+        existing = set(Ingredient.objects.filter(
+            name__in={name for name, _ in batch}
+        ).values_list(*FIELDS))
+        created = Ingredient.objects.bulk_create(
+            Ingredient(name=name, measurement_unit=unit)
+            for name, unit in batch if (name, unit) not in existing)
+        yield len(batch), len(created)
+
+
+class Command(BaseCommand):
+    help = ('Загружает справочник ингредиентов из CSV или JSON. '
+            'Уже существующие пары (название, единица измерения) '
+            'пропускаются, поэтому повторный запуск безопасен.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'path', nargs='?',
+            default=settings.BASE_DIR.parent / 'data' / 'ingredients.csv',
+            help='Файл справочника, по умолчанию data/ingredients.csv.')
+        parser.add_argument('--format', choices=READERS,
+                            help='Формат файла, по умолчанию по расширению.')
+        parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+
+    def handle(self, *args, **options):
+        path = str(options['path'])
+        file_format = options['format'] or path.rsplit('.', 1)[-1].lower()
+        if file_format not in READERS:
+            raise CommandError(
+                f'Доступные форматы: {", ".join(READERS)}')
+        started = monotonic()
+        read = created = 0
+        try:
+            with open(path, encoding='utf-8', newline='') as file, \
+                    transaction.atomic():
+                rows = READERS[file_format](file)
+                if connection.vendor == 'postgresql':
+                    with connection.cursor() as cursor:
+                        *loaded, created = copy_batches(
+                            cursor, batches(rows, options['batch_size']))
+                    read = sum(loaded)
+                else:
+                    size = min(options['batch_size'],
+                               connection.features.max_query_params
+                               or options['batch_size'])
+                    for batch_read, batch_created in insert_batches(
+                            batches(rows, size)):
+                        read += batch_read
+                        created += batch_created
+        except (OSError, KeyError, IndexError) as error:
+            raise CommandError(f'Не удалось прочитать {path}: {error!r}')
+        if created:
+            bump_catalog_version(INGREDIENTS_VERSION_KEY)
+        elapsed = monotonic() - started
+        self.stdout.write(self.style.SUCCESS(
+            f'Прочитано строк: {read}, добавлено: {created}, '
+            f'{read / elapsed if elapsed else read:.0f} строк/с'))
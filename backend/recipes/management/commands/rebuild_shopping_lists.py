@@ -0,0 +1,43 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from recipes.models import ShoppingListItem
+
+BATCH_SIZE = 1000
+
+
+class Command(BaseCommand):
+    help = ('Пересчитывает итоги списков покупок из корзин пользователей '
+            'или проверяет их (--check).')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--check', action='store_true',
+                            help='Только сравнить итоги, не изменяя их.')
+
+    def handle(self, *args, **options):
+        if options['check']:
+            return self.check_totals()
+        with transaction.atomic():
+            ShoppingListItem.objects.all().delete()
+            ShoppingListItem.objects.bulk_create(
+                (ShoppingListItem(user_id=user, ingredient_id=ingredient,
+                                  amount=total)
+                 for user, ingredient, total
+                 in ShoppingListItem.objects.expected().iterator()),
+                batch_size=BATCH_SIZE,
+            )
+        self.stdout.write(self.style.SUCCESS(
+            f'Пересчитано позиций: {ShoppingListItem.objects.count()}'))
+
+    def check_totals(self):
+        expected = {(user, ingredient): total for user, ingredient, total
+                    in ShoppingListItem.objects.expected().iterator()}
+        actual = {(user, ingredient): amount for user, ingredient, amount
+                  in ShoppingListItem.objects.values_list(
+                      'user', 'ingredient', 'amount').iterator()}
+        drift = [key for key in expected.keys() | actual.keys()
+                 if expected.get(key) != actual.get(key)]
+        if drift:
+            raise CommandError(
+                f'Расхождений: {len(drift)}. Запустите команду без --check.')
+        self.stdout.write(self.style.SUCCESS('Итоги списков покупок верны.'))
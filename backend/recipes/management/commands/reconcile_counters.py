@@ -0,0 +1,55 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Count, F, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+from recipes.models import FavoriteRecipe, Recipe, ShoppingCart
+from users.models import Follower, User
+
+# (модель со счетчиком, счетчик, связанная модель, поле связи)
+COUNTERS = (
+    (Recipe, 'favorites_count', FavoriteRecipe, 'recipe'),
+    (Recipe, 'in_carts_count', ShoppingCart, 'recipe'),
+    (User, 'recipes_count', Recipe, 'author'),
+    (User, 'followers_count', Follower, 'author'),
+)
+
+
+def actual_count(related, field):
+    """Подзапрос с фактическим числом связанных объектов."""
+    return Coalesce(Subquery(
+        related.objects.filter(**{field: OuterRef('pk')})
+        .order_by().values(field)
+        .annotate(total=Count('pk')).values('total')
+    ), 0)
+
+
+class Command(BaseCommand):
+    help = ('Пересчитывает счетчики избранного, списков покупок, рецептов '
+            'и подписчиков или проверяет их (--check).')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--check', action='store_true',
+                            help='Только сравнить счетчики, не изменяя их.')
+
+    def handle(self, *args, **options):
+        drift = 0
+        with transaction.atomic():
+            for model, counter, related, field in COUNTERS:
+                stale = (model.objects
+                         .alias(actual=actual_count(related, field))
+                         .exclude(**{counter: F('actual')}))
+                if options['check']:
+                    found = stale.count()
+                else:
+                    found = stale.update(
+                        **{counter: actual_count(related, field)})
+                drift += found
+                self.stdout.write(
+                    f'{model._meta.model_name}.{counter}: {found}')
+        if options['check'] and drift:
+            raise CommandError(
+                f'Расхождений: {drift}. Запустите команду без --check.')
+        self.stdout.write(self.style.SUCCESS(
+            f'Исправлено счетчиков: {drift}' if drift
+            else 'Счетчики верны.'))
@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from recipes.models import PopularRecipe, RecipePopularity
+
+
+class Command(BaseCommand):
+    help = ('Обновляет дневные итоги добавлений в избранное и списки '
+            'покупок и рейтинги популярных рецептов. Запускается '
+            'по расписанию, например раз в 10 минут.')
+
+    def handle(self, *args, **options):
+        today = timezone.localdate()
+        buckets = RecipePopularity.objects.refresh(today)
+        ranked = PopularRecipe.objects.rank(today)
+        self.stdout.write(self.style.SUCCESS(
+            f'Обновлено дневных итогов: {buckets}, '
+            f'мест в рейтингах: {ranked}'))
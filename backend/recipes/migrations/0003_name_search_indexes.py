@@ -0,0 +1,40 @@
+from django.contrib.postgres.operations import TrigramExtension
+from django.db import migrations
+
+TABLES = ('recipes_ingredient', 'recipes_recipe')
+
+
+def create_indexes(apps, schema_editor):
+    """
+    Индексы под UPPER(name::text) LIKE 'X%' (istartswith)
+    и триграммный поиск. Только для PostgreSQL.
+    """
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for table in TABLES:
+        schema_editor.execute(
+            f'CREATE INDEX IF NOT EXISTS {table}_name_upper_idx '
+            f'ON {table} (UPPER(name::text) text_pattern_ops)')
+        schema_editor.execute(
+            f'CREATE INDEX IF NOT EXISTS {table}_name_trgm_idx '
+            f'ON {table} USING gin (name gin_trgm_ops)')
+
+
+def drop_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for table in TABLES:
+        schema_editor.execute(f'DROP INDEX IF EXISTS {table}_name_upper_idx')
+        schema_editor.execute(f'DROP INDEX IF EXISTS {table}_name_trgm_idx')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0002_auto_20230729_2209'),
+    ]
+
+    operations = [
+        TrigramExtension(),
+        migrations.RunPython(create_indexes, drop_indexes),
+    ]
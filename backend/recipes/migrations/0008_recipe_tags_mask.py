@@ -0,0 +1,33 @@
+from django.db import migrations, models
+
+TAG_MASK_BITS = 63
+
+
+def fill_tags_mask(apps, schema_editor):
+    Recipe = apps.get_model('recipes', 'Recipe')
+    masks = {}
+    for recipe, tag in Recipe.tags.through.objects.values_list(
+            'recipe', 'tag').iterator():
+        if tag <= TAG_MASK_BITS:
+            masks[recipe] = masks.get(recipe, 0) | 1 << (tag - 1)
+    Recipe.objects.bulk_update(
+        (Recipe(id=recipe, tags_mask=mask) for recipe, mask in masks.items()),
+        ('tags_mask',),
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0007_timelineentry'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='tags_mask',
+            field=models.BigIntegerField(default=0, editable=False, help_text='Заполняется автоматически по тегам рецепта', verbose_name='Маска тегов'),
+        ),
+        migrations.RunPython(fill_tags_mask, migrations.RunPython.noop),
+    ]
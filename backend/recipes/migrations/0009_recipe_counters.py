@@ -0,0 +1,45 @@
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def fill_counters(apps, schema_editor):
+    Recipe = apps.get_model('recipes', 'Recipe')
+    User = apps.get_model('users', 'User')
+    counters = (
+        (Recipe, 'favorites_count',
+         apps.get_model('recipes', 'FavoriteRecipe'), 'recipe'),
+        (Recipe, 'in_carts_count',
+         apps.get_model('recipes', 'ShoppingCart'), 'recipe'),
+        (User, 'recipes_count', Recipe, 'author'),
+        (User, 'followers_count',
+         apps.get_model('users', 'Follower'), 'author'),
+    )
+    for model, counter, related, field in counters:
+        model.objects.update(**{counter: Coalesce(Subquery(
+            related.objects.filter(**{field: OuterRef('pk')})
+            .order_by().values(field)
+            .annotate(total=Count('pk')).values('total')
+        ), 0)})
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0003_user_counters'),
+        ('recipes', '0008_recipe_tags_mask'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='favorites_count',
+            field=models.PositiveIntegerField(db_index=True, default=0, editable=False, verbose_name='В избранном'),
+        ),
+        migrations.AddField(
+            model_name='recipe',
+            name='in_carts_count',
+            field=models.PositiveIntegerField(db_index=True, default=0, editable=False, verbose_name='В списках покупок'),
+        ),
+        migrations.RunPython(fill_counters, migrations.RunPython.noop),
+    ]
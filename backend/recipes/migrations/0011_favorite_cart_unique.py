@@ -0,0 +1,44 @@
+from django.db import migrations, models
+from django.db.models import Count, Min, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def remove_duplicate_favorites(apps, schema_editor):
+    FavoriteRecipe = apps.get_model('recipes', 'FavoriteRecipe')
+    Recipe = apps.get_model('recipes', 'Recipe')
+    keep = (FavoriteRecipe.objects.values('user', 'recipe').order_by()
+            .annotate(first=Min('id'), total=Count('id'))
+            .filter(total__gt=1))
+    for row in keep.iterator():
+        FavoriteRecipe.objects.filter(
+            user=row['user'], recipe=row['recipe']
+        ).exclude(id=row['first']).delete()
+    Recipe.objects.update(favorites_count=Coalesce(Subquery(
+        FavoriteRecipe.objects.filter(recipe=OuterRef('pk'))
+        .order_by().values('recipe')
+        .annotate(total=Count('pk')).values('total')
+    ), 0))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0010_popular_recipes'),
+    ]
+
+    operations = [
+        migrations.RunPython(remove_duplicate_favorites,
+                             migrations.RunPython.noop),
+        migrations.AlterUniqueTogether(
+            name='shoppingcart',
+            unique_together=set(),
+        ),
+        migrations.AddConstraint(
+            model_name='favoriterecipe',
+            constraint=models.UniqueConstraint(fields=('user', 'recipe'), name='user_recipe_unique_in_favoriterecipe'),
+        ),
+        migrations.AddConstraint(
+            model_name='shoppingcart',
+            constraint=models.UniqueConstraint(fields=('user', 'recipe'), name='user_recipe_unique_in_shoppingcart'),
+        ),
+    ]
@@ -0,0 +1,17 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0012_catalogversion'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='variants_image',
+            field=models.CharField(blank=True, default='', editable=False, max_length=100, verbose_name='Картинка с готовыми уменьшенными копиями'),
+            preserve_default=False,
+        ),
+    ]
@@ -1,10 +1,33 @@
+from datetime import datetime, time, timedelta
+
+from django.conf import settings
+from django.core.cache import cache
 from django.core.validators import MinValueValidator, RegexValidator
-from django.db import models
+from django.db import models, transaction
+from django.db.models import (Case, Count, Exists, F, FilteredRelation, Max,
+                              OuterRef, Prefetch, Q, Sum, Value, When, Window,)
+from django.db.models.expressions import RawSQL
+from django.db.models.functions import Coalesce, RowNumber, TruncDate
+from django.utils import timezone
 
 from recipes.constants import (MAX_LENGTH_CHARFIELD, MAX_LENGTH_TAG_COLOR,
                                MIN_VALIDATOR_COOK_TIME_INGRED_AMOUNT,
-                               REDEX_TAG_SLUG,)
-from users.models import User
+                               POPULAR_SIZE, POPULAR_WINDOWS, REDEX_TAG_SLUG,
+                               TAG_MASK_BITS,)
+from users.models import Follower, UpdateOnlyFieldsMixin, User
+
+USER_FLAGS = ('is_favorited', 'is_in_shopping_cart')
+
+
+def change_counter(queryset, counter, delta):
+    """
+    Атомарно меняет счетчик counter у объектов queryset на delta.
+    Счетчик не уходит ниже нуля, расхождения исправляет
+    команда reconcile_counters.
+    """
+    if delta < 0:
+        queryset = queryset.filter(**{f'{counter}__gte': -delta})
+    return queryset.update(**{counter: F(counter) + delta})
 
 
 class Tag(models.Model):
@@ -46,6 +69,15 @@ class Tag(models.Model):
     def __str__(self):
         return self.name
 
+    @staticmethod
+    def mask(tag_ids):
+        """Маска по id тегов. Теги вне маски не учитываются."""
+        mask = 0
+        for tag_id in tag_ids:
+            if tag_id <= TAG_MASK_BITS:
+                mask |= 1 << (tag_id - 1)
+        return mask
+
 
 class Ingredient(models.Model):
     """
@@ -77,7 +109,103 @@ class Ingredient(models.Model):
         return f'{self.name}, {self.measurement_unit}'
 
 
-class Recipe(models.Model):
+class RecipeQuerySet(models.QuerySet):
+    """Выборки рецептов с подгрузкой связанных данных."""
+
+    def with_related(self, author=True, tags=True, ingredients=True):
+        """Автор, теги и ингредиенты загружаются фиксированным числом
+        запросов, независимо от количества рецептов.
+        Ненужные для ответа связи можно отключить."""
+        queryset = self.select_related('author') if author else self
+        if tags:
+            queryset = queryset.prefetch_related(
+                Prefetch('tags', queryset=Tag.objects.order_by('id')))
+        if ingredients:
+            queryset = queryset.prefetch_related(Prefetch(
+                'recipeingredients',
+                queryset=RecipeIngredient.objects.select_related(
+                    'ingredient').order_by('id'),
+            ))
+        return queryset
+
+    def with_tags(self, tag_ids, match_all=False):
+        """
+        Рецепты с любым (или, при match_all, со всеми) из тегов tag_ids.
+        Проверяется битовая маска tags_mask без соединения с тегами.
+        """
+        if max(tag_ids) > TAG_MASK_BITS:
+            if not match_all:
+                return self.filter(tags__in=tag_ids).distinct()
+            queryset = self
+            for tag_id in tag_ids:
+                queryset = queryset.filter(tags=tag_id)
+            return queryset
+        mask = Tag.mask(tag_ids)
+        matched = self.alias(tag_match=F('tags_mask').bitand(mask))
+        if match_all:
+            return matched.filter(tag_match=mask)
+        return matched.exclude(tag_match=0)
+
+    def with_user_flags(self, user, fields=USER_FLAGS):
+        """
+        Аннотирует is_favorited и is_in_shopping_cart для пользователя
+        (только флаги, перечисленные в fields).
+        """
+        if not user.is_authenticated:
+            flags = dict.fromkeys(
+                USER_FLAGS, Value(False, output_field=models.BooleanField()))
+        else:
+            flags = {
+                'is_favorited': Exists(FavoriteRecipe.objects.filter(
+                    user=user, recipe=OuterRef('pk'))),
+                'is_in_shopping_cart': Exists(ShoppingCart.objects.filter(
+                    user=user, recipe=OuterRef('pk'))),
+            }
+        return self.annotate(**{name: flag for name, flag in flags.items()
+                                if name in fields})
+
+    def feed(self, user):
+        """
+        Лента пользователя: рецепты из его таймлайна и рецепты
+        подписок на авторов с большим числом подписчиков,
+        для которых таймлайн не заполняется (pull on read).
+        Лента отсортирована по дате из таймлайна (поле feed_pub_date),
+        поэтому без таких подписок страница читается по индексу
+        timeline_user_pub_date_idx.
+        """
+        recipes = self.alias(entry=FilteredRelation(
+            'timeline', condition=Q(timeline__user=user)))
+        pull = TimelineEntry.objects.pull_authors()
+        pull = list(Follower.objects.filter(
+            user=user, author__in=pull
+        ).values_list('author', flat=True)) if pull else []
+        if not pull:
+            recipes = recipes.filter(entry__isnull=False).annotate(
+                feed_pub_date=F('entry__pub_date'))
+        else:
+            recipes = recipes.filter(
+                Q(entry__isnull=False) | Q(author__in=pull)
+            ).annotate(feed_pub_date=Coalesce('entry__pub_date', 'pub_date'))
+        return recipes.order_by('-feed_pub_date', '-id')
+
+    def latest_per_author(self, limit):
+        """
+        Не более limit последних рецептов каждого автора одним запросом:
+        ROW_NUMBER() OVER (PARTITION BY author ORDER BY pub_date DESC).
+        """
+        windowed = self.order_by().annotate(recipe_rank=Window(
+            expression=RowNumber(),
+            partition_by=F('author'),
+            order_by=F('pub_date').desc(),
+        )).values('id', 'recipe_rank')
+        sql, params = windowed.query.sql_with_params()
+        return self.model.objects.filter(pk__in=RawSQL(
+            f'SELECT id FROM ({sql}) AS windowed WHERE recipe_rank <= %s',
+            (*params, limit),
+        ))
+
+
+class Recipe(UpdateOnlyFieldsMixin, models.Model):
     """Класс, описывающий рецепты."""
     name = models.CharField(
         max_length=MAX_LENGTH_CHARFIELD,
@@ -106,12 +234,24 @@ class Recipe(models.Model):
         blank=False,
         null=False,
     )
+    variants_image = models.CharField(
+        verbose_name='Картинка с готовыми уменьшенными копиями',
+        max_length=100,
+        blank=True,
+        editable=False,
+    )
     tags = models.ManyToManyField(
         Tag,
         verbose_name='Теги',
         help_text='Обязательное поле',
         blank=False,
     )
+    tags_mask = models.BigIntegerField(
+        verbose_name='Маска тегов',
+        help_text='Заполняется автоматически по тегам рецепта',
+        default=0,
+        editable=False,
+    )
     ingredients = models.ManyToManyField(
         Ingredient,
         through='RecipeIngredient',
@@ -138,11 +278,35 @@ class Recipe(models.Model):
         verbose_name='Дата публикации',
         auto_now_add=True,
     )
+    favorites_count = models.PositiveIntegerField(
+        verbose_name='В избранном',
+        default=0,
+        editable=False,
+        db_index=True,
+    )
+    in_carts_count = models.PositiveIntegerField(
+        verbose_name='В списках покупок',
+        default=0,
+        editable=False,
+        db_index=True,
+    )
+    updated_at = models.DateTimeField(
+        verbose_name='Дата изменения',
+        auto_now=True,
+    )
+
+    objects = RecipeQuerySet.as_manager()
+    update_only_fields = ('favorites_count', 'in_carts_count',
+                          'variants_image')
 
     class Meta:
         verbose_name = 'Рецепт'
         verbose_name_plural = 'Рецепты'
         ordering = ('-pub_date',)
+        indexes = (
+            models.Index(fields=('-pub_date', '-id'),
+                         name='recipe_pub_date_id_idx'),
+        )
 
     def __str__(self):
         return f"Рецепт: {self.name}. Автор: {self.author.username}"
@@ -198,6 +362,12 @@ class FavoriteRecipe(models.Model):
         related_name='favorite',
         verbose_name='Рецепт',
     )
+    created_at = models.DateTimeField(
+        verbose_name='Дата добавления',
+        auto_now_add=True,
+        null=True,
+        db_index=True,
+    )
 
     class Meta:
         verbose_name = 'Избранный рецепт'
@@ -231,6 +401,12 @@ class ShoppingCart(models.Model):
         related_name='shopping_cart',
         verbose_name='Рецепт'
     )
+    created_at = models.DateTimeField(
+        verbose_name='Дата добавления',
+        auto_now_add=True,
+        null=True,
+        db_index=True,
+    )
 
     class Meta:
         verbose_name = 'Список покупок'
@@ -245,3 +421,384 @@ class ShoppingCart(models.Model):
     def __str__(self):
         return (f'{self.user.username} добавил'
                 f'{self.recipe.name} в список покупок')
+
+
+class ShoppingListItemQuerySet(models.QuerySet):
+    """
+    Поддержка итогов списка покупок в актуальном состоянии.
+    Все изменения выполняются атомарными UPDATE ... SET amount = amount + x.
+    """
+
+    def apply(self, users, amounts):
+        """
+        Прибавляет к итогам пользователей users количества amounts
+        ({ingredient_id: amount}, количество может быть отрицательным).
+        """
+        amounts = {ingredient: amount
+                   for ingredient, amount in amounts.items() if amount}
+        users = list(users)
+        if not amounts or not users:
+            return
+        with transaction.atomic():
+            self.bulk_create(
+                [self.model(user_id=user, ingredient_id=ingredient, amount=0)
+                 for user in users
+                 for ingredient, amount in amounts.items() if amount > 0],
+                ignore_conflicts=True,
+            )
+            items = self.filter(user__in=users, ingredient__in=amounts)
+            items.update(amount=F('amount') + Case(
+                *(When(ingredient=ingredient, then=Value(amount))
+                  for ingredient, amount in amounts.items()),
+                default=Value(0),
+                output_field=models.IntegerField(),
+            ))
+            items.filter(amount__lte=0).delete()
+
+    @staticmethod
+    def recipe_amounts(recipes):
+        """Суммарное количество ингредиентов рецептов: {id: amount}."""
+        return dict(RecipeIngredient.objects.filter(recipe__in=recipes)
+                    .order_by().values_list('ingredient')
+                    .annotate(total=Sum('amount')))
+
+    def add_recipes(self, user_id, recipes):
+        """Добавляет в итоги пользователя рецепты recipes (id)."""
+        self.apply([user_id], self.recipe_amounts(recipes))
+
+    def remove_recipes(self, user_id, recipes):
+        """Убирает из итогов пользователя рецепты recipes (id)."""
+        self.apply([user_id], {ingredient: -amount for ingredient, amount
+                               in self.recipe_amounts(recipes).items()})
+
+    def recipe_changed(self, recipe_id, amounts):
+        """
+        Переносит изменение состава рецепта amounts
+        ({ingredient_id: разница}) в списки покупок с этим рецептом.
+        """
+        self.apply(ShoppingCart.objects.filter(recipe=recipe_id)
+                   .values_list('user', flat=True), amounts)
+
+    def expected(self):
+        """Итоги, посчитанные заново из рецептов в корзинах."""
+        return (RecipeIngredient.objects
+                .filter(recipe__shopping_cart__isnull=False)
+                .values_list('recipe__shopping_cart__user', 'ingredient')
+                .annotate(total=Sum('amount'))
+                .order_by())
+
+
+class ShoppingListItem(models.Model):
+    """
+    Итоговое количество ингредиента в списке покупок пользователя.
+    Поддерживается при изменении корзины и состава рецептов,
+    чтобы скачивание списка было одним чтением по индексу.
+    """
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='shopping_list',
+        verbose_name='Пользователь'
+    )
+    ingredient = models.ForeignKey(
+        Ingredient,
+        on_delete=models.CASCADE,
+        related_name='shopping_list_items',
+        verbose_name='Ингредиент'
+    )
+    amount = models.IntegerField(verbose_name='Количество')
+
+    objects = ShoppingListItemQuerySet.as_manager()
+
+    class Meta:
+        verbose_name = 'Позиция списка покупок'
+        verbose_name_plural = 'Итоги списков покупок'
+        constraints = (
+            models.UniqueConstraint(
+                fields=('user', 'ingredient'),
+                name='user_ingredient_unique_in_shoppinglistitem'
+            ),
+        )
+
+    def __str__(self):
+        return f'{self.user.username}: {self.ingredient} - {self.amount}'
+
+
+class TimelineEntryQuerySet(models.QuerySet):
+    """Заполнение таймлайнов подписчиков (fan-out on write)."""
+
+    def pull_authors(self):
+        """
+        Авторы, у которых подписчиков больше FEED_FANOUT_LIMIT.
+        Их рецепты не раскладываются по таймлайнам, а читаются из ленты
+        напрямую. Список кешируется на FEED_PULL_AUTHORS_TIMEOUT секунд
+        и один и тот же используется в fan_out и в ленте. Авторам,
+        вышедшим из списка при пересчете, заполняются таймлайны.
+        """
+        authors = cache.get('feed:pull_authors')
+        if authors is None:
+            authors = list(User.objects.filter(
+                followers_count__gt=settings.FEED_FANOUT_LIMIT
+            ).values_list('id', flat=True))
+            previous = cache.get('feed:pull_authors:previous')
+            if previous:
+                self.backfill(set(previous) - set(authors))
+            cache.set('feed:pull_authors:previous', authors, timeout=None)
+            cache.set('feed:pull_authors', authors,
+                      timeout=settings.FEED_PULL_AUTHORS_TIMEOUT)
+        return authors
+
+    def fan_out(self, recipe):
+        """Добавляет новый рецепт в таймлайны подписчиков автора."""
+        if recipe.author_id in self.pull_authors():
+            return
+        self.bulk_create(
+            (self.model(user_id=user, recipe=recipe,
+                        pub_date=recipe.pub_date)
+             for user in recipe.author.following.values_list(
+                 'user', flat=True).iterator()),
+            batch_size=settings.FEED_BATCH_SIZE,
+            ignore_conflicts=True,
+        )
+
+    def backfill(self, authors):
+        """
+        Добавляет в таймлайны подписчиков последние рецепты авторов:
+        пока автор был в pull_authors, fan_out их пропускал.
+        """
+        for author in User.objects.filter(id__in=authors):
+            recipes = list(author.recipes.values_list(
+                'id', 'pub_date')[:settings.FEED_BACKFILL_SIZE])
+            self.bulk_create(
+                (self.model(user_id=user, recipe_id=recipe,
+                            pub_date=pub_date)
+                 for user in author.following.values_list(
+                     'user', flat=True).iterator()
+                 for recipe, pub_date in recipes),
+                batch_size=settings.FEED_BATCH_SIZE,
+                ignore_conflicts=True,
+            )
+
+    def follow(self, user, author):
+        """Добавляет в таймлайн последние рецепты нового автора."""
+        if author.id in self.pull_authors():
+            return
+        self.bulk_create(
+            (self.model(user=user, recipe_id=recipe, pub_date=pub_date)
+             for recipe, pub_date in author.recipes.values_list(
+                 'id', 'pub_date')[:settings.FEED_BACKFILL_SIZE]),
+            ignore_conflicts=True,
+        )
+
+    def unfollow(self, user, author):
+        self.filter(user=user, recipe__author=author).delete()
+
+
+class TimelineEntry(models.Model):
+    """
+    Запись таймлайна: рецепт автора, на которого подписан пользователь.
+    Заполняется при публикации рецепта, чтобы лента читалась
+    по индексу (user, pub_date).
+    """
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='timeline',
+        verbose_name='Пользователь'
+    )
+    recipe = models.ForeignKey(
+        Recipe,
+        on_delete=models.CASCADE,
+        related_name='timeline',
+        verbose_name='Рецепт'
+    )
+    pub_date = models.DateTimeField(verbose_name='Дата публикации')
+
+    objects = TimelineEntryQuerySet.as_manager()
+
+    class Meta:
+        verbose_name = 'Запись ленты'
+        verbose_name_plural = 'Ленты подписок'
+        constraints = (
+            models.UniqueConstraint(
+                fields=('user', 'recipe'),
+                name='user_recipe_unique_in_timelineentry'
+            ),
+        )
+        indexes = (
+            models.Index(fields=('user', '-pub_date'),
+                         name='timeline_user_pub_date_idx'),
+        )
+
+    def __str__(self):
+        return f'{self.user.username}: {self.recipe.name}'
+
+
+class RecipePopularityQuerySet(models.QuerySet):
+    """Дневные итоги добавлений рецептов в избранное и списки покупок."""
+
+    def refresh(self, today):
+        """
+        Пересчитывает итоги начиная с последнего посчитанного дня:
+        более ранние дни уже закрыты, их записи не перечитываются.
+        Дни старше самого длинного окна удаляются. Записи, добавленные
+        до появления поля created_at, не имеют даты и не учитываются.
+        """
+        oldest = today - timedelta(days=max(POPULAR_WINDOWS.values()) - 1)
+        last = self.aggregate(last=Max('day'))['last']
+        since = max(last or oldest, oldest)
+        start = timezone.make_aware(datetime.combine(since, time.min))
+        totals = {}
+        for model, position in ((FavoriteRecipe, 0), (ShoppingCart, 1)):
+            rows = (model.objects.filter(created_at__gte=start)
+                    .annotate(day=TruncDate('created_at'))
+                    .values_list('recipe', 'day')
+                    .annotate(total=Count('id')).order_by())
+            for recipe, day, total in rows.iterator():
+                totals.setdefault((recipe, day), [0, 0])[position] = total
+        with transaction.atomic():
+            self.filter(Q(day__gte=since) | Q(day__lt=oldest)).delete()
+            self.bulk_create(
+                (self.model(recipe_id=recipe, day=day,
+                            favorites=favorites, carts=carts)
+                 for (recipe, day), (favorites, carts) in totals.items()),
+                batch_size=1000,
+            )
+        return len(totals)
+
+
+class RecipePopularity(models.Model):
+    """Число добавлений рецепта в избранное и списки покупок за день."""
+    recipe = models.ForeignKey(
+        Recipe,
+        on_delete=models.CASCADE,
+        related_name='popularity',
+        verbose_name='Рецепт'
+    )
+    day = models.DateField(verbose_name='День', db_index=True)
+    favorites = models.PositiveIntegerField(
+        verbose_name='Добавлений в избранное', default=0)
+    carts = models.PositiveIntegerField(
+        verbose_name='Добавлений в списки покупок', default=0)
+
+    objects = RecipePopularityQuerySet.as_manager()
+
+    class Meta:
+        verbose_name = 'Популярность за день'
+        verbose_name_plural = 'Популярность по дням'
+        constraints = (
+            models.UniqueConstraint(
+                fields=('recipe', 'day'),
+                name='recipe_day_unique_in_recipepopularity'
+            ),
+        )
+
+    def __str__(self):
+        return f'{self.recipe.name}, {self.day}'
+
+
+class PopularRecipeQuerySet(models.QuerySet):
+
+    def rank(self, today):
+        """Заново строит рейтинги всех окон по дневным итогам."""
+        rankings = []
+        for window, days in POPULAR_WINDOWS.items():
+            scores = (RecipePopularity.objects
+                      .filter(day__gt=today - timedelta(days=days))
+                      .values('recipe')
+                      .annotate(score=Sum('favorites') + Sum('carts'))
+                      .order_by('-score', '-recipe_id')[:POPULAR_SIZE])
+            rankings += (
+                self.model(window=window, position=position,
+                           recipe_id=row['recipe'], score=row['score'])
+                for position, row in enumerate(scores, start=1))
+        with transaction.atomic():
+            self.all().delete()
+            self.bulk_create(rankings)
+        return len(rankings)
+
+
+class PopularRecipe(models.Model):
+    """Место рецепта в рейтинге популярных за окно window."""
+    window = models.CharField(
+        max_length=max(map(len, POPULAR_WINDOWS)),
+        verbose_name='Окно',
+    )
+    position = models.PositiveSmallIntegerField(verbose_name='Место')
+    recipe = models.ForeignKey(
+        Recipe,
+        on_delete=models.CASCADE,
+        related_name='popular',
+        verbose_name='Рецепт'
+    )
+    score = models.PositiveIntegerField(verbose_name='Добавлений')
+
+    objects = PopularRecipeQuerySet.as_manager()
+
+    class Meta:
+        verbose_name = 'Популярный рецепт'
+        verbose_name_plural = 'Популярные рецепты'
+        ordering = ('window', 'position')
+        constraints = (
+            models.UniqueConstraint(
+                fields=('window', 'recipe'),
+                name='window_recipe_unique_in_popularrecipe'
+            ),
+        )
+
+    def __str__(self):
+        return f'{self.window} #{self.position}: {self.recipe.name}'
+
+
+class CatalogVersionQuerySet(models.QuerySet):
+    """Версии справочников, общие для всех процессов."""
+
+    def versions(self, keys):
+        """
+        Версии справочников keys. Значения кешируются
+        на CATALOG_VERSION_TIMEOUT секунд, недостающие читаются из базы.
+        """
+        versions = cache.get_many(keys)
+        missing = [key for key in keys if key not in versions]
+        if missing:
+            stored = dict(self.filter(key__in=missing)
+                          .values_list('key', 'version'))
+            loaded = {key: stored.get(key, 0) for key in missing}
+            cache.set_many(loaded, timeout=settings.CATALOG_VERSION_TIMEOUT)
+            versions.update(loaded)
+        return [versions[key] for key in keys]
+
+    def bump(self, key):
+        """
+        Увеличивает версию справочника. Кеш версии сбрасывается сразу
+        и после коммита, остальные процессы видят новую версию
+        не позже чем через CATALOG_VERSION_TIMEOUT секунд.
+        """
+        if not self.filter(key=key).update(version=F('version') + 1):
+            _, created = self.get_or_create(key=key, defaults={'version': 1})
+            if not created:
+                self.filter(key=key).update(version=F('version') + 1)
+        cache.delete(key)
+        transaction.on_commit(lambda: cache.delete(key))
+
+
+class CatalogVersion(models.Model):
+    """Версия справочника: меняется при каждом изменении его данных."""
+    key = models.CharField(
+        max_length=MAX_LENGTH_CHARFIELD,
+        primary_key=True,
+        verbose_name='Справочник'
+    )
+    version = models.PositiveBigIntegerField(
+        default=0,
+        verbose_name='Версия'
+    )
+
+    objects = CatalogVersionQuerySet.as_manager()
+
+    class Meta:
+        verbose_name = 'Версия справочника'
+        verbose_name_plural = 'Версии справочников'
+
+    def __str__(self):
+        return f'{self.key}: {self.version}'
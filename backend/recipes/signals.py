@@ -0,0 +1,183 @@
+from django.db import transaction
+from django.db.models import F
+from django.db.models.signals import (m2m_changed, post_delete, post_save,
+                                      pre_save,)
+from django.dispatch import receiver
+from django.utils import timezone
+from import_export.signals import post_import
+
+from recipes.constants import INGREDIENTS_VERSION_KEY, TAGS_VERSION_KEY
+from recipes.models import (CatalogVersion, FavoriteRecipe, Ingredient, Recipe,
+                            RecipeIngredient, ShoppingCart, ShoppingListItem,
+                            Tag, TimelineEntry, change_counter,)
+from users.models import Follower, User
+
+# Отправитель сигнала: (модель со счетчиком, поле связи, счетчик)
+COUNTERS = {
+    FavoriteRecipe: (Recipe, 'recipe_id', 'favorites_count'),
+    ShoppingCart: (Recipe, 'recipe_id', 'in_carts_count'),
+    Recipe: (User, 'author_id', 'recipes_count'),
+    Follower: (User, 'author_id', 'followers_count'),
+}
+
+
+def get_catalog_version(key):
+    """Текущая версия справочника."""
+    return CatalogVersion.objects.versions([key])[0]
+
+
+def get_catalog_versions(*keys):
+    """Текущие версии нескольких справочников одним запросом."""
+    return CatalogVersion.objects.versions(keys)
+
+
+def bump_catalog_version(key):
+    """Помечает справочник измененным для всех процессов."""
+    CatalogVersion.objects.bump(key)
+
+
+@receiver(post_save, sender=Ingredient)
+@receiver(post_delete, sender=Ingredient)
+def ingredients_changed(**kwargs):
+    bump_catalog_version(INGREDIENTS_VERSION_KEY)
+
+
+@receiver(post_save, sender=Tag)
+@receiver(post_delete, sender=Tag)
+def tags_changed(**kwargs):
+    bump_catalog_version(TAGS_VERSION_KEY)
+
+
+@receiver(post_import)
+def catalog_imported(model, **kwargs):
+    if model is Ingredient:
+        bump_catalog_version(INGREDIENTS_VERSION_KEY)
+    elif model is Tag:
+        bump_catalog_version(TAGS_VERSION_KEY)
+
+
+@receiver(pre_save, sender=ShoppingCart)
+@receiver(pre_save, sender=RecipeIngredient)
+def remember_previous(sender, instance, **kwargs):
+    """
+    Прежнее состояние изменяемой записи, чтобы перенести
+    в списки покупок разницу, а не всю запись.
+    """
+    fields = ('user', 'recipe') if sender is ShoppingCart else (
+        'recipe', 'ingredient', 'amount')
+    instance.previous = (
+        sender.objects.filter(pk=instance.pk).values_list(*fields).first()
+        if instance.pk else None)
+
+
+@receiver(post_save, sender=ShoppingCart)
+def cart_saved(instance, created, **kwargs):
+    """
+    Итоги списка покупок для одиночных изменений корзины.
+    Пакетные операции без сигналов обновляют итоги сами.
+    """
+    previous = getattr(instance, 'previous', None)
+    if not created and previous == (instance.user_id, instance.recipe_id):
+        return
+    if previous:
+        user, recipe = previous
+        ShoppingListItem.objects.remove_recipes(user, [recipe])
+    ShoppingListItem.objects.add_recipes(instance.user_id,
+                                         [instance.recipe_id])
+
+
+@receiver(post_delete, sender=ShoppingCart)
+def cart_deleted(instance, **kwargs):
+    """
+    Удаление рецепта каскадом удаляет и корзины, и состав рецепта.
+    Обработчики обоих сигналов читают текущее состояние базы,
+    поэтому количества рецепта вычитаются один раз при любом
+    порядке удаления.
+    """
+    ShoppingListItem.objects.remove_recipes(instance.user_id,
+                                            [instance.recipe_id])
+
+
+@receiver(post_save, sender=RecipeIngredient)
+def recipe_ingredient_saved(instance, **kwargs):
+    changes = {instance.recipe_id: {instance.ingredient_id: instance.amount}}
+    previous = getattr(instance, 'previous', None)
+    if previous:
+        recipe, ingredient, amount = previous
+        amounts = changes.setdefault(recipe, {})
+        amounts[ingredient] = amounts.get(ingredient, 0) - amount
+    for recipe, amounts in changes.items():
+        ShoppingListItem.objects.recipe_changed(recipe, amounts)
+
+
+@receiver(post_delete, sender=RecipeIngredient)
+def recipe_ingredient_deleted(instance, **kwargs):
+    ShoppingListItem.objects.recipe_changed(
+        instance.recipe_id, {instance.ingredient_id: -instance.amount})
+
+
+@receiver(post_save, sender=RecipeIngredient)
+@receiver(post_delete, sender=RecipeIngredient)
+def recipe_ingredients_touched(instance, signal, **kwargs):
+    """
+    Изменение состава рецепта меняет его updated_at,
+    от которого зависят ETag и Last-Modified рецепта.
+    """
+    recipes = {instance.recipe_id}
+    previous = getattr(instance, 'previous', None)
+    if signal is post_save and previous:
+        recipes.add(previous[0])
+    Recipe.objects.filter(pk__in=recipes).update(updated_at=timezone.now())
+
+
+@receiver(post_save, sender=Recipe)
+def recipe_published(instance, created, **kwargs):
+    if created:
+        transaction.on_commit(lambda: TimelineEntry.objects.fan_out(instance))
+
+
+@receiver(post_save, sender=Follower)
+def author_followed(instance, created, **kwargs):
+    if created:
+        TimelineEntry.objects.follow(instance.user, instance.author)
+
+
+@receiver(post_delete, sender=Follower)
+def author_unfollowed(instance, **kwargs):
+    TimelineEntry.objects.unfollow(instance.user, instance.author)
+
+
+@receiver(m2m_changed, sender=Recipe.tags.through)
+def recipe_tags_changed(instance, action, reverse, pk_set, **kwargs):
+    """Поддерживает Recipe.tags_mask при изменении тегов рецепта."""
+    if reverse:
+        mask = Tag.mask((instance.pk,))
+        recipes = (Recipe.objects.filter(tags=instance)
+                   if action == 'pre_clear'
+                   else Recipe.objects.filter(pk__in=pk_set or ()))
+    else:
+        mask = Tag.mask(pk_set or ())
+        recipes = Recipe.objects.filter(pk=instance.pk)
+    if action == 'post_add':
+        recipes.update(tags_mask=F('tags_mask').bitor(mask))
+    elif action == 'post_remove' or reverse and action == 'pre_clear':
+        recipes.update(tags_mask=F('tags_mask').bitand(~mask))
+    elif not reverse and action == 'post_clear':
+        recipes.update(tags_mask=0)
+
+
+@receiver(post_save, sender=FavoriteRecipe)
+@receiver(post_delete, sender=FavoriteRecipe)
+@receiver(post_save, sender=ShoppingCart)
+@receiver(post_delete, sender=ShoppingCart)
+@receiver(post_save, sender=Recipe)
+@receiver(post_delete, sender=Recipe)
+@receiver(post_save, sender=Follower)
+@receiver(post_delete, sender=Follower)
+def update_counters(sender, instance, signal, created=False, **kwargs):
+    """Поддерживает счетчики избранного, корзин, рецептов и подписчиков."""
+    if signal is post_save and not created:
+        return
+    model, field, counter = COUNTERS[sender]
+    change_counter(model.objects.filter(pk=getattr(instance, field)),
+                   counter, 1 if created else -1)
@@ -0,0 +1,218 @@
+from unittest import mock, skipUnless
+
+from django.db import connection
+from django.test import TestCase
+from django.utils import timezone
+
+from api.serializers import RecipeCreateSerializer
+from recipes import images
+from recipes.models import (FavoriteRecipe, Ingredient, Recipe,
+                            RecipeIngredient, RecipePopularity, ShoppingCart,
+                            ShoppingListItem, Tag,)
+from users.models import Follower, User
+
+
+@skipUnless(connection.vendor == 'postgresql',
+            'Индексы поиска по названию создаются только в PostgreSQL.')
+class NameSearchIndexTest(TestCase):
+    """Поиск по названию использует индексы из миграции 0003 (EXPLAIN)."""
+
+    def setUp(self):
+        # На маленьких таблицах планировщик выбирает полный перебор,
+        # поэтому он запрещается: план покажет, применим ли индекс.
+        with connection.cursor() as cursor:
+            cursor.execute('SET enable_seqscan = off')
+        self.addCleanup(self.reset_seqscan)
+
+    @staticmethod
+    def reset_seqscan():
+        with connection.cursor() as cursor:
+            cursor.execute('RESET enable_seqscan')
+
+    def assert_uses_index(self, queryset, index):
+        plan = queryset.explain()
+        self.assertIn(index, plan)
+        self.assertNotIn('Seq Scan', plan)
+
+    def test_istartswith(self):
+        for model in (Ingredient, Recipe):
+            with self.subTest(model=model.__name__):
+                self.assert_uses_index(
+                    model.objects.filter(name__istartswith='сол'),
+                    f'{model._meta.db_table}_name_upper_idx')
+
+    def test_trigram_similar(self):
+        for model in (Ingredient, Recipe):
+            with self.subTest(model=model.__name__):
+                self.assert_uses_index(
+                    model.objects.filter(name__trigram_similar='соль'),
+                    f'{model._meta.db_table}_name_trgm_idx')
+
+
+class ShoppingListTotalsTest(TestCase):
+    """Итоги списков покупок при одиночных изменениях (админка, ORM)."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user(
+            username='author', email='author@test.ru', password='password')
+        cls.users = [
+            User.objects.create_user(
+                username=f'user{number}', email=f'user{number}@test.ru',
+                password='password')
+            for number in range(2)]
+        cls.ingredients = [
+            Ingredient.objects.create(name=f'Ингредиент {number}',
+                                      measurement_unit='г')
+            for number in range(3)]
+        cls.recipes = [
+            Recipe.objects.create(
+                author=cls.author, name=f'Рецепт {number}', text='Описание',
+                image='recipes/test.png', cooking_time=5)
+            for number in range(2)]
+        for recipe in cls.recipes:
+            for amount, ingredient in enumerate(cls.ingredients[:2], 1):
+                RecipeIngredient.objects.create(
+                    recipe=recipe, ingredient=ingredient, amount=amount)
+
+    def assert_totals(self):
+        self.assertEqual(
+            sorted(ShoppingListItem.objects.values_list(
+                'user', 'ingredient', 'amount')),
+            sorted(ShoppingListItem.objects.expected()))
+
+    def test_single_row_changes(self):
+        first, second = self.recipes
+        carts = [ShoppingCart.objects.create(user=user, recipe=first)
+                 for user in self.users]
+        ShoppingCart.objects.create(user=self.users[0], recipe=second)
+        self.assert_totals()
+        recipe_ingredient = first.recipeingredients.first()
+        recipe_ingredient.amount = 10
+        recipe_ingredient.save()
+        self.assert_totals()
+        recipe_ingredient.ingredient = self.ingredients[2]
+        recipe_ingredient.save()
+        self.assert_totals()
+        RecipeIngredient.objects.create(
+            recipe=second, ingredient=self.ingredients[2], amount=3)
+        self.assert_totals()
+        first.recipeingredients.last().delete()
+        self.assert_totals()
+        carts[1].recipe = second
+        carts[1].save()
+        self.assert_totals()
+        carts[0].delete()
+        self.assert_totals()
+
+    def test_ingredients_added_to_empty_recipe(self):
+        recipe = Recipe.objects.create(
+            author=self.author, name='Пустой рецепт', text='Описание',
+            image='recipes/test.png', cooking_time=5)
+        ShoppingCart.objects.create(user=self.users[0], recipe=recipe)
+        tag = Tag.objects.create(name='Тег', color='#000000', slug='tag')
+        serializer = RecipeCreateSerializer(recipe, partial=True, data={
+            'tags': [tag.id],
+            'ingredients': [{'id': self.ingredients[0].id, 'amount': 5}]})
+        serializer.is_valid(raise_exception=True)
+        serializer.save()
+        self.assert_totals()
+        self.assertEqual(
+            list(ShoppingListItem.objects.values_list(
+                'user', 'ingredient', 'amount')),
+            [(self.users[0].id, self.ingredients[0].id, 5)])
+
+    def test_recipe_deleted(self):
+        for user in self.users:
+            for recipe in self.recipes:
+                ShoppingCart.objects.create(user=user, recipe=recipe)
+        self.recipes[0].delete()
+        self.assert_totals()
+        self.assertEqual(
+            dict(ShoppingListItem.objects.filter(user=self.users[0])
+                 .values_list('ingredient', 'amount')),
+            {self.ingredients[0].id: 1, self.ingredients[1].id: 2})
+
+
+class ImageVariantsTest(TestCase):
+    """Ссылки на копии картинки строятся без обращений к хранилищу."""
+
+    def setUp(self):
+        patcher = mock.patch.object(images.default_storage, 'exists',
+                                    return_value=True)
+        self.exists = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_urls_without_storage(self):
+        name = 'recipes/test.png'
+        with mock.patch.object(images, 'schedule_variants') as schedule:
+            self.assertEqual(set(images.image_variants(name).values()),
+                             {f'/media/{name}'})
+            schedule.assert_called_once_with(name)
+            self.assertEqual(
+                images.image_variants(name, name)['card'],
+                f'/media/recipes/test_card.{images.IMAGE_EXTENSION}')
+        self.exists.assert_not_called()
+
+    def test_generation_marks_recipes(self):
+        author = User.objects.create_user(
+            username='author', email='author@test.ru', password='password')
+        recipe = Recipe.objects.create(
+            author=author, name='Рецепт', text='Описание',
+            image='recipes/test.png', cooking_time=5)
+        images.run_generation(recipe.image.name)
+        recipe.refresh_from_db()
+        self.assertEqual(recipe.variants_image, recipe.image.name)
+
+
+class CounterSaveTest(TestCase):
+    """Сохранение загруженного ранее объекта не затирает счетчики."""
+
+    def test_stale_save(self):
+        author, user = (
+            User.objects.create_user(username=name, email=f'{name}@test.ru',
+                                     password='password')
+            for name in ('author', 'user'))
+        recipe = Recipe.objects.create(
+            author=author, name='Рецепт', text='Описание',
+            image='recipes/test.png', cooking_time=5)
+        stale_recipe = Recipe.objects.get(pk=recipe.pk)
+        stale_author = User.objects.get(pk=author.pk)
+        FavoriteRecipe.objects.create(user=user, recipe=recipe)
+        Follower.objects.create(user=user, author=author)
+        stale_recipe.name = 'Новое название'
+        stale_recipe.save()
+        stale_author.set_password('new-password')
+        stale_author.save()
+        recipe.refresh_from_db()
+        author.refresh_from_db()
+        self.assertEqual((recipe.name, recipe.favorites_count),
+                         ('Новое название', 1))
+        self.assertEqual((author.recipes_count, author.followers_count),
+                         (1, 1))
+        self.assertTrue(author.check_password('new-password'))
+
+
+class RecipePopularityTest(TestCase):
+    """Дневные итоги популярности не учитывают записи без даты."""
+
+    def test_historical_rows_skipped(self):
+        author, *users = (
+            User.objects.create_user(username=name, email=f'{name}@test.ru',
+                                     password='password')
+            for name in ('author', 'old', 'new'))
+        recipe = Recipe.objects.create(
+            author=author, name='Рецепт', text='Описание',
+            image='recipes/test.png', cooking_time=5)
+        for user in users:
+            FavoriteRecipe.objects.create(user=user, recipe=recipe)
+            ShoppingCart.objects.create(user=user, recipe=recipe)
+        # Записи, добавленные до появления created_at.
+        for model in (FavoriteRecipe, ShoppingCart):
+            model.objects.filter(user=users[0]).update(created_at=None)
+        today = timezone.localdate()
+        RecipePopularity.objects.refresh(today)
+        self.assertEqual(
+            list(RecipePopularity.objects.values_list(
+                'recipe', 'day', 'favorites', 'carts')),
+            [(recipe.id, today, 1, 1)])
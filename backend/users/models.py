@@ -7,7 +7,29 @@ from users.constants import (MAX_LENGTH_USER_CHARFIELD, MAX_LENGTH_USER_EMAIL,
 from users.validators import validate_username
 
 
-class User(AbstractUser):
+class UpdateOnlyFieldsMixin:
+    """
+    Поля update_only_fields (счетчики и поля, которые заполняют фоновые
+    задачи) меняются только запросами UPDATE, например с F()
+    в change_counter. При сохранении существующего объекта они
+    не записываются: иначе save() вернул бы значение, прочитанное
+    до параллельных изменений.
+    """
+    update_only_fields = ()
+
+    def save(self, *args, **kwargs):
+        if not self._state.adding and kwargs.get('update_fields') is None:
+            deferred = self.get_deferred_fields()
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key
+                and field.name not in self.update_only_fields
+                and field.attname not in deferred
+            ]
+        super().save(*args, **kwargs)
+
+
+class User(UpdateOnlyFieldsMixin, AbstractUser):
     """Класс кастомных пользователей."""
 
     email = models.EmailField(
@@ -49,6 +71,19 @@ class User(AbstractUser):
         blank=False,
         null=False,
     )
+    recipes_count = models.PositiveIntegerField(
+        verbose_name='Рецептов',
+        default=0,
+        editable=False,
+    )
+    followers_count = models.PositiveIntegerField(
+        verbose_name='Подписчиков',
+        default=0,
+        editable=False,
+        db_index=True,
+    )
+
+    update_only_fields = ('recipes_count', 'followers_count')
 
     class Meta:
         verbose_name = 'Пользователь'